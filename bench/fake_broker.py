@@ -0,0 +1,226 @@
+# fake_broker.py - In-process stand-in for RabbitMQ with the pika API the workers call.
+# Queues are in-memory; every message remembers when it was published, so the
+# harness can measure queue wait separately from processing time, and an origin
+# tag identifying the submitted job it belongs to, so it can measure end-to-end
+# latency. A message published without an origin inherits the one registered
+# for its trace ID, so jobs keep their origin through every hand-off.
+#
+# FakeConnection stands in for pika.BlockingConnection under consumer.consume():
+# deliveries are dispatched on the thread that calls process_data_events, and
+# each consumer holds at most its basic_qos prefetch of unacknowledged ones.
+
+import itertools
+import threading
+import time
+from collections import deque, namedtuple
+
+Delivery = namedtuple('Delivery', ['delivery_tag', 'routing_key', 'properties', 'body', 'published_at', 'origin',
+                                   'redelivered'], defaults=(False,))
+
+
+class Method:
+    """The subset of pika's Basic.Deliver the callbacks read, plus the delivery for the harness."""
+
+    def __init__(self, delivery_tag, routing_key, redelivered=False, delivery=None):
+        self.delivery_tag = delivery_tag
+        self.routing_key = routing_key
+        self.redelivered = redelivered
+        self.delivery = delivery
+
+
+def _trace_id(properties):
+    traceparent = ((getattr(properties, 'headers', None) or {}).get('traceparent') or '').split('-')
+    return traceparent[1] if len(traceparent) == 4 else None
+
+
+class FakeBroker:
+    """Named FIFO queues with publish/get/ack, safe to use from many threads."""
+
+    def __init__(self):
+        self._queues = {}
+        self._unacked = {}
+        self._origins = {} # trace ID -> origin
+        self._tags = itertools.count(1)
+        self._cond = threading.Condition()
+        self.acked = 0
+
+    def queue_declare(self, queue, durable=False, **kwargs):
+        with self._cond:
+            self._queues.setdefault(queue, deque())
+
+    def publish(self, routing_key, body, properties=None, origin=None):
+        """Enqueues a message; origin is carried along unchanged to every message the job produces (defaults to now)."""
+        now = time.monotonic()
+        if isinstance(body, str):
+            body = body.encode() # pika encodes str bodies as UTF-8.
+        trace_id = _trace_id(properties)
+        with self._cond:
+            if origin is not None and trace_id:
+                self._origins[trace_id] = origin
+            elif origin is None:
+                origin = self._origins.get(trace_id, now)
+            self._queues.setdefault(routing_key, deque()).append(
+                Delivery(next(self._tags), routing_key, properties, body, now, origin))
+            self._cond.notify_all()
+
+    def get(self, queue, timeout=None):
+        """Pops the next delivery from queue, waiting up to timeout. Returns None on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not self._queues.get(queue):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            delivery = self._queues[queue].popleft()
+            self._unacked[delivery.delivery_tag] = delivery
+            return delivery
+
+    def ack(self, delivery_tag):
+        with self._cond:
+            if self._unacked.pop(delivery_tag, None) is None:
+                raise ValueError(f"Unknown delivery tag {delivery_tag}")
+            self.acked += 1
+            self._cond.notify_all()
+
+    def requeue(self, delivery_tag):
+        """Puts an unacknowledged delivery back at the head of its queue, marked redelivered."""
+        with self._cond:
+            delivery = self._unacked.pop(delivery_tag)
+            self._queues[delivery.routing_key].appendleft(delivery._replace(redelivered=True))
+            self._cond.notify_all()
+
+    def depth(self, queue):
+        with self._cond:
+            return len(self._queues.get(queue, ()))
+
+    def connection(self):
+        return FakeConnection(self)
+
+
+class _Consumer:
+    def __init__(self, queue, on_message, prefetch):
+        self.queue = queue
+        self.on_message = on_message
+        self.prefetch = prefetch # 0 means unlimited, as in basic.qos
+        self.unacked = set()
+
+    def has_room(self):
+        return not self.prefetch or len(self.unacked) < self.prefetch
+
+
+class FakeConnection:
+    """pika.BlockingConnection stand-in for consumer.consume().
+
+    As with pika, deliveries and add_callback_threadsafe callbacks only run
+    inside process_data_events. As with RabbitMQ's per-consumer basic.qos, a
+    consumer gets the prefetch_count set by the last basic_qos before its
+    basic_consume. close() returns unacknowledged deliveries to their queues.
+    """
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._callbacks = deque()
+        self._consumers = {} # consumer tag -> _Consumer
+        self._owners = {} # delivery tag -> _Consumer
+        self._prefetch = 0
+        self._tags = itertools.count(1)
+        self._channel = FakeConsumerChannel(self)
+
+    def channel(self):
+        return self._channel
+
+    def add_callback_threadsafe(self, callback):
+        with self._broker._cond:
+            self._callbacks.append(callback)
+            self._broker._cond.notify_all()
+
+    def process_data_events(self, time_limit=0):
+        """Runs pending callbacks and dispatches deliveries, waiting up to time_limit for any."""
+        deadline = time.monotonic() + (time_limit or 0)
+        cond = self._broker._cond
+        with cond:
+            while True:
+                callbacks = list(self._callbacks)
+                self._callbacks.clear()
+                deliveries = self._take()
+                if callbacks or deliveries:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                cond.wait(remaining)
+        for callback in callbacks:
+            callback()
+        for consumer, delivery in deliveries:
+            method = Method(delivery.delivery_tag, delivery.routing_key, delivery.redelivered, delivery)
+            consumer.on_message(self._channel, method, delivery.properties, delivery.body)
+
+    def _take(self):
+        """Pops deliveries for consumers with room, round-robin across them. Called with the lock held."""
+        taken = []
+        progress = True
+        while progress:
+            progress = False
+            for consumer in list(self._consumers.values()):
+                if not consumer.has_room():
+                    continue
+                delivery = self._broker.get(consumer.queue, timeout=0)
+                if delivery is None:
+                    continue
+                consumer.unacked.add(delivery.delivery_tag)
+                self._owners[delivery.delivery_tag] = consumer
+                taken.append((consumer, delivery))
+                progress = True
+        return taken
+
+    def _settle(self, delivery_tag, requeue=False):
+        with self._broker._cond:
+            consumer = self._owners.pop(delivery_tag, None)
+            if consumer is not None:
+                consumer.unacked.discard(delivery_tag)
+            if requeue:
+                self._broker.requeue(delivery_tag)
+            else:
+                self._broker.ack(delivery_tag)
+
+    def close(self):
+        with self._broker._cond:
+            self._consumers.clear()
+            for delivery_tag in list(self._owners):
+                self._settle(delivery_tag, requeue=True)
+
+
+class FakeConsumerChannel:
+    """The BlockingChannel of a FakeConnection, with the calls consumer.consume() and the workers make."""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._broker = connection._broker
+
+    def queue_declare(self, queue, durable=False, **kwargs):
+        self._broker.queue_declare(queue, durable)
+
+    def basic_qos(self, prefetch_count=0, **kwargs):
+        self._connection._prefetch = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback, **kwargs):
+        connection = self._connection
+        with self._broker._cond:
+            consumer_tag = f"ctag-{next(connection._tags)}"
+            connection._consumers[consumer_tag] = _Consumer(queue, on_message_callback, connection._prefetch)
+            self._broker._cond.notify_all()
+        return consumer_tag
+
+    def basic_cancel(self, consumer_tag):
+        with self._broker._cond:
+            self._connection._consumers.pop(consumer_tag, None)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._broker.publish(routing_key, body, properties)
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._connection._settle(delivery_tag)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._connection._settle(delivery_tag, requeue=requeue)
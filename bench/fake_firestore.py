@@ -0,0 +1,321 @@
+# fake_firestore.py - In-memory stand-in for the parts of firebase_admin the workers use.
+# install() registers fake 'firebase_admin', 'firebase_admin.credentials' and
+# 'firebase_admin.firestore' modules, so worker.py files import and initialize
+# against FakeFirestore instead of a real project. An optional per-round-trip
+# delay models the network cost of each Firestore call, and documents over
+# Firestore's size limit are rejected like the real service rejects them.
+
+import copy
+import operator
+import sys
+import threading
+import time
+import types
+import uuid
+
+
+class _Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+SERVER_TIMESTAMP = _Sentinel('SERVER_TIMESTAMP')
+
+
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class NotFound(Exception):
+    pass
+
+
+class InvalidArgument(Exception):
+    pass
+
+
+# Firestore rejects documents larger than this.
+MAX_DOCUMENT_BYTES = 1024 * 1024
+
+
+def document_size(value):
+    """Approximates the stored size of a value with Firestore's sizing rules."""
+    if isinstance(value, dict):
+        return sum(len(key.encode()) + 1 + document_size(v) for key, v in value.items())
+    if isinstance(value, list):
+        return sum(document_size(v) for v in value)
+    if isinstance(value, str):
+        return len(value.encode()) + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if value is None or isinstance(value, bool):
+        return 1
+    return 8
+
+
+def _resolve(value, current=None):
+    """Replaces write sentinels with the values Firestore would store."""
+    if value is SERVER_TIMESTAMP:
+        return time.time()
+    if isinstance(value, ArrayUnion):
+        existing = list(current) if isinstance(current, list) else []
+        return existing + [v for v in value.values if v not in existing]
+    if isinstance(value, dict):
+        return {k: _resolve(v) for k, v in value.items()}
+    return copy.deepcopy(value)
+
+
+class DocumentSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field):
+        value = self._data
+        for key in field.split('.'):
+            value = value[key]
+        return copy.deepcopy(value)
+
+
+class DocumentReference:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def _key(self):
+        return (self._collection, self.id)
+
+    @property
+    def path(self):
+        return f"{self._collection}/{self.id}"
+
+    def collection(self, name):
+        """A subcollection, stored flat under its full path, e.g. 'jobs/<id>/reportChunks'."""
+        return CollectionReference(self._db, f"{self.path}/{name}")
+
+    def get(self, transaction=None):
+        self._db._round_trip()
+        with self._db._lock:
+            return DocumentSnapshot(self.id, copy.deepcopy(self._db.docs.get(self._key)))
+
+    def set(self, data, merge=False):
+        self._db._round_trip()
+        with self._db._lock:
+            self._db._apply('set', self._key, data, merge)
+
+    def update(self, fields):
+        self._db._round_trip()
+        with self._db._lock:
+            self._db._apply('update', self._key, fields)
+
+    def delete(self):
+        self._db._round_trip()
+        with self._db._lock:
+            self._db._apply('delete', self._key, None)
+
+
+class CollectionReference:
+    def __init__(self, db, name):
+        self._db = db
+        self.name = name
+
+    def document(self, document_id=None):
+        return DocumentReference(self._db, self.name, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return time.time(), ref
+
+    def stream(self):
+        return Query(self).stream()
+
+    def list_documents(self):
+        self._db._round_trip()
+        with self._db._lock:
+            return [self.document(doc_id) for (coll, doc_id) in sorted(self._db.docs) if coll == self.name]
+
+    def where(self, filter):
+        return Query(self).where(filter)
+
+    def limit(self, count):
+        return Query(self).limit(count)
+
+
+class FieldFilter:
+    _OPS = {'==': operator.eq, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+    def __init__(self, field_path, op_string, value):
+        self.field_path = field_path
+        self.op = self._OPS[op_string]
+        self.value = value
+
+    def matches(self, data):
+        value = data.get(self.field_path)
+        return value is not None and self.op(value, self.value)
+
+
+class Query:
+    """Field filters and a limit over one collection, in document ID order."""
+
+    def __init__(self, collection, filters=(), count=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._count = count
+
+    def where(self, filter):
+        return Query(self._collection, self._filters + (filter,), self._count)
+
+    def limit(self, count):
+        return Query(self._collection, self._filters, count)
+
+    def stream(self):
+        db = self._collection._db
+        db._round_trip()
+        with db._lock:
+            matches = [DocumentSnapshot(doc_id, copy.deepcopy(data))
+                       for (coll, doc_id), data in sorted(db.docs.items())
+                       if coll == self._collection.name and all(f.matches(data) for f in self._filters)]
+        return matches[:self._count] if self._count is not None else matches
+
+
+class WriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(('set', ref._key, data, merge))
+
+    def update(self, ref, fields):
+        self._writes.append(('update', ref._key, fields, False))
+
+    def delete(self, ref):
+        self._writes.append(('delete', ref._key, None, False))
+
+    def commit(self):
+        """Applies every write atomically, like a Firestore batch: all or nothing."""
+        self._db._round_trip()
+        with self._db._lock:
+            for kind, key, data, _ in self._writes:
+                if kind == 'update' and key not in self._db.docs:
+                    raise NotFound(f"No document to update: {key[0]}/{key[1]}")
+            # _apply replaces documents rather than mutating them, so a shallow copy can roll back.
+            before = dict(self._db.docs)
+            try:
+                for kind, key, data, merge in self._writes:
+                    self._db._apply(kind, key, data, merge)
+            except Exception:
+                self._db.docs = before
+                raise
+            self._db.commits += 1
+
+
+class Transaction(WriteBatch):
+    pass
+
+
+def transactional(fn):
+    """Runs fn(transaction) with the whole fake database locked, then commits its writes."""
+    def run(transaction, *args, **kwargs):
+        db = transaction._db
+        with db._transaction_lock:
+            result = fn(transaction, *args, **kwargs)
+            transaction.commit()
+        return result
+    return run
+
+
+class FakeFirestore:
+    """Thread-safe in-memory document store with Firestore's write semantics."""
+
+    def __init__(self, latency_seconds=0.0, max_document_bytes=MAX_DOCUMENT_BYTES):
+        self.latency_seconds = latency_seconds
+        self.max_document_bytes = max_document_bytes
+        self.docs = {} # (collection, id) -> dict
+        self.round_trips = 0
+        self.commits = 0
+        self._lock = threading.RLock()
+        self._transaction_lock = threading.RLock()
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def _apply(self, kind, key, data, merge=False):
+        if kind == 'delete':
+            self.docs.pop(key, None)
+        elif kind == 'set' and not merge:
+            doc = _resolve(data)
+            self._check_size(key, doc)
+            self.docs[key] = doc
+        else:
+            if kind == 'update' and key not in self.docs:
+                raise NotFound(f"No document to update: {key[0]}/{key[1]}")
+            doc = copy.deepcopy(self.docs.get(key, {}))
+            for path, value in data.items():
+                target = doc
+                parts = path.split('.') if kind == 'update' else [path]
+                for part in parts[:-1]:
+                    if not isinstance(target.get(part), dict):
+                        target[part] = {}
+                    target = target[part]
+                target[parts[-1]] = _resolve(value, target.get(parts[-1]))
+            self._check_size(key, doc)
+            self.docs[key] = doc
+
+    def _check_size(self, key, doc):
+        size = document_size(doc)
+        if size > self.max_document_bytes:
+            raise InvalidArgument(f"Document {key[0]}/{key[1]} is {size} bytes, over the {self.max_document_bytes} byte limit")
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def documents(self, collection):
+        with self._lock:
+            return {doc_id: copy.deepcopy(data) for (coll, doc_id), data in self.docs.items() if coll == collection}
+
+
+def install(db):
+    """Registers fake firebase_admin modules whose firestore.client() returns db."""
+    firestore = types.ModuleType('firebase_admin.firestore')
+    firestore.SERVER_TIMESTAMP = SERVER_TIMESTAMP
+    firestore.ArrayUnion = ArrayUnion
+    firestore.FieldFilter = FieldFilter
+    firestore.transactional = transactional
+    firestore.client = lambda app=None: db
+
+    credentials = types.ModuleType('firebase_admin.credentials')
+    credentials.Certificate = lambda path: object()
+
+    firebase_admin = types.ModuleType('firebase_admin')
+    firebase_admin._apps = {}
+    firebase_admin.initialize_app = lambda cred=None, options=None, name='[DEFAULT]': firebase_admin._apps.setdefault(name, object())
+    firebase_admin.credentials = credentials
+    firebase_admin.firestore = firestore
+
+    sys.modules['firebase_admin'] = firebase_admin
+    sys.modules['firebase_admin.credentials'] = credentials
+    sys.modules['firebase_admin.firestore'] = firestore
@@ -0,0 +1,431 @@
+# run_bench.py - Offline end-to-end benchmark for the analysis pipeline.
+# Generates synthetic repositories, serves them over file://, and pushes jobs
+# through the real workers (their consume_jobs() and callbacks) with an
+# in-process broker and an in-memory Firestore, so throughput and per-stage
+# latency can be measured without RabbitMQ, Firebase or network access.
+# Results are written as JSON that can be compared against a baseline run.
+#
+#   python bench/run_bench.py --jobs 40 --output results.json
+#   python bench/run_bench.py --topology fused --compare results.json
+
+import argparse
+import contextlib
+import random
+import importlib.util
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+import pika
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_firestore
+from fake_broker import FakeBroker
+from synth_repo import generate_repo
+
+# Stage name -> (worker directory, queue it consumes).
+SPLIT_STAGES = [
+    ('cloner', 'dispatch-worker-cloner', 'analysis_jobs'),
+    ('security', 'dispatch-worker-security', 'cloning_complete_jobs'),
+    ('complexity', 'dispatch-worker-complexity', 'security_scan_complete_jobs'),
+]
+FUSED_STAGES = [
+    ('pipeline', 'dispatch-worker-pipeline', 'analysis_jobs'),
+]
+SUBMIT_QUEUE = 'analysis_jobs'
+
+# Metrics compared by --compare; higher is better only for throughput.
+THROUGHPUT_KEY = 'jobsPerSecond'
+
+
+def percentiles(samples):
+    """Returns count/mean/p50/p95/p99/max of a list of seconds, in milliseconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 2),
+        'p50': round(rank(50), 2),
+        'p95': round(rank(95), 2),
+        'p99': round(rank(99), 2),
+        'max': round(ordered[-1] * 1000, 2),
+    }
+
+
+def load_worker(stage, directory):
+    """Imports a worker.py under a unique module name, with its directory importable."""
+    path = os.path.join(REPO_ROOT, directory)
+    if path not in sys.path:
+        sys.path.append(path)
+    spec = importlib.util.spec_from_file_location(f"bench_{stage}_worker", os.path.join(path, 'worker.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def report_sizes(db, job_docs, report_dir):
+    """How big the job documents ended up, and how much went to report chunks instead."""
+    chunk_sizes = [fake_firestore.document_size(doc) for (collection, _), doc in list(db.docs.items())
+                   if collection.endswith('/reportChunks')]
+    for dirpath, _, filenames in os.walk(report_dir):
+        chunk_sizes.extend(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+    return {
+        'largestJobDocBytes': max((fake_firestore.document_size(doc) for doc in job_docs.values()), default=0),
+        'chunks': len(chunk_sizes),
+        'chunkBytes': sum(chunk_sizes),
+    }
+
+
+def peak_rss_mib():
+    """Peak resident set size of this process and of its reaped children (process pools, git)."""
+    scale = 1024 if sys.platform != 'darwin' else 1024 * 1024 # ru_maxrss is KiB on Linux, bytes on macOS.
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class _CountingChannel:
+    """Passes a callback's channel calls through, counting publishes so the driver can tell a job was handed on."""
+
+    def __init__(self, channel):
+        self._channel = channel
+        self.published = 0
+
+    def basic_publish(self, *args, **kwargs):
+        self.published += 1
+        self._channel.basic_publish(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+
+class StageDriver:
+    """Runs one worker through its consume_jobs() on a fake connection, as its main() does when deployed.
+
+    Deliveries therefore go through the same lane queues, prefetch windows,
+    scheduler and thread-safe acks as in production; only the broker is in-process.
+    """
+
+    def __init__(self, name, module, queue, broker, on_job_done):
+        self.name = name
+        self.module = module
+        self.queue = queue
+        self.broker = broker
+        self.on_job_done = on_job_done
+        self.queue_wait = []
+        self.processing = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._consume, name=f"{name}-connection", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _consume(self):
+        connection = self.broker.connection()
+        self.module.consume_jobs(connection, connection.channel(), on_message=self._process, stopping=self._stop)
+
+    def _process(self, ch, method, properties, body):
+        delivery = method.delivery
+        started = time.monotonic()
+        channel = _CountingChannel(ch)
+        self.module.callback(channel, method, properties, body)
+        finished = time.monotonic()
+        with self._lock:
+            self.queue_wait.append(started - delivery.published_at)
+            self.processing.append(finished - started)
+        # A callback that hands nothing on has finished the job: completed,
+        # served from the result cache, or failed.
+        if not channel.published:
+            submitted_at, size_class = delivery.origin
+            self.on_job_done(finished - submitted_at, size_class)
+
+    def summary(self):
+        # The worker's own span histograms break processing time down further.
+        spans = {}
+        for labels, (count, total) in self.module.tracer.metrics.snapshot('dispatch_span_seconds').items():
+            if count:
+                spans[dict(labels)['span']] = {'count': count, 'mean': round(total / count * 1000, 2)}
+        return {'queueWait': percentiles(self.queue_wait), 'processing': percentiles(self.processing), 'spans': spans}
+
+
+def build_repos(args, root):
+    """Generates the synthetic repos; returns [(file:// URL, [commit SHAs oldest first], size class)].
+
+    The first --large-repos repos get --large-files files instead of --files.
+    """
+    repos = []
+    for i in range(args.repos):
+        path = os.path.join(root, f"repo{i}")
+        size_class = 'large' if i < args.large_repos else 'small'
+        url = generate_repo(path, files=args.large_files if size_class == 'large' else args.files,
+                            avg_bytes=args.avg_bytes, mix=args.mix, seed=args.seed + i, commits=args.commits)
+        shas = subprocess.run(['git', 'rev-list', '--reverse', 'HEAD'], cwd=path, check=True,
+                              stdout=subprocess.PIPE).stdout.decode().split()
+        repos.append((url, shas, size_class))
+    return repos
+
+
+def job_payloads(args, repos):
+    """Returns [(payload, size class)]: jobs walk each repo's history in order, round-robin across repos.
+
+    Large repos all belong to one heavy user whose batch is submitted first,
+    the case that head-of-line blocks everyone else in a FIFO queue.
+    """
+    jobs = []
+    for n in range(args.jobs):
+        url, shas, size_class = repos[n % len(repos)]
+        jobs.append(({
+            'jobId': f"bench-job-{n:05d}",
+            'repoUrl': url,
+            'userId': 'bench-user-0' if size_class == 'large' else f"bench-user-{n % args.users}",
+            'commitSha': shas[(n // len(repos)) % len(shas)],
+        }, size_class))
+    jobs.sort(key=lambda job: job[1] != 'large')
+    return jobs
+
+
+def submit_properties():
+    """The trace headers dispatch-api attaches to a submitted job."""
+    now = int(time.time() * 1000)
+    return pika.BasicProperties(delivery_mode=2, headers={
+        'traceparent': '00-%032x-%016x-01' % (random.getrandbits(128), random.getrandbits(64)),
+        'x-dispatch-timings': {'api.received': now, 'api.submitted': now},
+        'x-dispatch-published-at': now,
+    })
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='dispatch-bench-')
+    # Every cache the workers keep goes under the scratch directory, so each run starts cold.
+    os.environ['REPO_CACHE_DIR'] = os.path.join(workdir, 'repo_cache')
+    os.environ['BLOB_CACHE_PATH'] = os.path.join(workdir, 'blob_cache.db')
+    if args.advisory_db:
+        os.environ['ADVISORY_DB_PATH'] = os.path.abspath(args.advisory_db)
+    else:
+        os.environ.setdefault('ADVISORY_DB_PATH', os.path.join(workdir, 'advisories.db'))
+    os.environ['COST_HISTORY_PATH'] = os.path.join(workdir, 'cost_history.db')
+    os.environ['SCHED_SMALL_REPO_MAX_MB'] = str(args.small_repo_max_mb)
+    # The synthetic repos are served over file://, which the size probe only measures under allowed roots.
+    os.environ['SIZE_PROBE_FILE_ROOTS'] = os.path.join(workdir, 'repos')
+    os.environ['WORKER_CONCURRENCY'] = str(args.concurrency)
+    os.environ['FAIR_SCHEDULING'] = '1' if args.fair else '0'
+    if args.prefetch:
+        os.environ['WORKER_PREFETCH'] = os.environ['SCHED_PREFETCH'] = str(args.prefetch)
+    os.environ['REPORT_STORE'] = args.report_store
+    os.environ['REPORT_STORE_DIR'] = os.path.join(workdir, 'reports')
+
+    print(f" [*] Generating {args.repos} repos x {args.commits} commits x {args.files} files in {workdir}")
+    repos = build_repos(args, os.path.join(workdir, 'repos'))
+    jobs = job_payloads(args, repos)
+
+    db = fake_firestore.FakeFirestore(latency_seconds=args.firestore_latency_ms / 1000)
+    fake_firestore.install(db)
+    os.chdir(workdir) # Workers clone into ./temp_repos.
+
+    stages = FUSED_STAGES if args.topology == 'fused' else SPLIT_STAGES
+    broker = FakeBroker()
+    end_to_end = [] # (seconds, size class)
+    done = threading.Condition()
+
+    def on_job_done(latency, size_class):
+        with done:
+            end_to_end.append((latency, size_class))
+            done.notify_all()
+
+    log = open(os.devnull, 'w') if not args.verbose else sys.stdout
+    with contextlib.redirect_stdout(log):
+        drivers = []
+        for name, directory, queue in stages:
+            module = load_worker(name, directory)
+            module.declare_stage_queues(broker, queue)
+            drivers.append(StageDriver(name, module, queue, broker, on_job_done))
+
+        started = time.monotonic()
+        for driver in drivers:
+            driver.start()
+        for payload, size_class in jobs:
+            payload['submittedAt'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            broker.publish(SUBMIT_QUEUE, json.dumps(payload).encode(), submit_properties(),
+                           origin=(time.monotonic(), size_class))
+            if args.rate:
+                time.sleep(1 / args.rate)
+        with done:
+            if not done.wait_for(lambda: len(end_to_end) >= len(jobs), timeout=args.timeout):
+                print(f" [!] Timed out with {len(end_to_end)}/{len(jobs)} jobs finished", file=sys.stderr)
+        wall = time.monotonic() - started
+
+        for driver in drivers:
+            driver.stop()
+        for driver in drivers:
+            driver.module.job_writer.flush()
+
+    job_docs = db.documents('jobs')
+    statuses = Counter(doc.get('status') for doc in job_docs.values())
+    return {
+        'meta': {
+            'runId': uuid.uuid4().hex[:12],
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'gitRevision': git_revision(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'topology': args.topology,
+            'jobs': args.jobs,
+            'repos': args.repos,
+            'commits': args.commits,
+            'files': args.files,
+            'largeRepos': args.large_repos,
+            'largeFiles': args.large_files,
+            'avgBytes': args.avg_bytes,
+            'mix': args.mix,
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'fair': args.fair,
+            'prefetch': args.prefetch,
+            'smallRepoMaxMb': args.small_repo_max_mb,
+            'rate': args.rate,
+            'firestoreLatencyMs': args.firestore_latency_ms,
+            'reportStore': args.report_store,
+        },
+        'throughput': {
+            'wallSeconds': round(wall, 3),
+            'jobsFinished': len(end_to_end),
+            THROUGHPUT_KEY: round(len(end_to_end) / wall, 3) if wall else None,
+        },
+        'endToEnd': percentiles([latency for latency, _ in end_to_end]),
+        'endToEndBySize': {size_class: percentiles([latency for latency, c in end_to_end if c == size_class])
+                           for size_class in sorted({c for _, c in end_to_end})},
+        'stages': {driver.name: driver.summary() for driver in drivers},
+        'statuses': dict(statuses),
+        'firestore': {'roundTrips': db.round_trips, 'batchCommits': db.commits},
+        'reports': report_sizes(db, job_docs, os.environ['REPORT_STORE_DIR']),
+        'peakRssMiB': peak_rss_mib(),
+    }
+
+
+def compare(results, baseline, max_regression):
+    """Prints metric deltas against a baseline run; returns the regressions past max_regression."""
+    differing = [key for key in results['meta']
+                 if key not in ('runId', 'timestamp', 'gitRevision') and results['meta'][key] != baseline['meta'].get(key)]
+    if differing:
+        print(f" [!] Baseline was run with different settings ({', '.join(differing)}); deltas are not like for like.")
+    rows = [('throughput', THROUGHPUT_KEY, results['throughput'].get(THROUGHPUT_KEY),
+             baseline['throughput'].get(THROUGHPUT_KEY), True)]
+    for p in ('p50', 'p95', 'p99'):
+        rows.append(('endToEnd', p, results['endToEnd'].get(p), baseline['endToEnd'].get(p), False))
+    for size_class, summary in results.get('endToEndBySize', {}).items():
+        base = baseline.get('endToEndBySize', {}).get(size_class, {})
+        for p in ('p50', 'p95', 'p99'):
+            rows.append((f"endToEnd.{size_class}", p, summary.get(p), base.get(p), False))
+    for stage, summary in results['stages'].items():
+        base = baseline['stages'].get(stage)
+        if not base:
+            continue
+        for metric in ('processing', 'queueWait'):
+            for p in ('p50', 'p95', 'p99'):
+                rows.append((f"{stage}.{metric}", p, summary[metric].get(p), base[metric].get(p), False))
+    rows.append(('peakRssMiB', 'self', results['peakRssMiB']['self'], baseline['peakRssMiB']['self'], False))
+    rows.append(('peakRssMiB', 'children', results['peakRssMiB']['children'], baseline['peakRssMiB']['children'], False))
+
+    regressions = []
+    print(f"{'metric':<36}{'baseline':>12}{'current':>12}{'change':>10}")
+    for group, key, current, previous, higher_is_better in rows:
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = -change if higher_is_better else change
+        flag = ' !' if worse > max_regression else ''
+        print(f"{group + '.' + key:<36}{previous:>12.2f}{current:>12.2f}{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(f"{group}.{key}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark of the Dispatch workers.')
+    parser.add_argument('--topology', choices=('split', 'fused'), default='split',
+                        help='three stage workers over queues, or the fused pipeline worker')
+    parser.add_argument('--jobs', type=int, default=20)
+    parser.add_argument('--repos', type=int, default=4)
+    parser.add_argument('--commits', type=int, default=5, help='commits per repo; jobs walk them in order')
+    parser.add_argument('--files', type=int, default=200, help='source files per repo')
+    parser.add_argument('--large-repos', type=int, default=0,
+                        help='how many of the repos are large; their jobs belong to one user and are submitted first')
+    parser.add_argument('--large-files', type=int, default=2000, help='source files per large repo')
+    parser.add_argument('--avg-bytes', type=int, default=4000, help='average source file size')
+    parser.add_argument('--mix', default='py=2,js=1,java=1', help='language weights, e.g. py=3,js=1,go=1')
+    parser.add_argument('--users', type=int, default=4, help='distinct userIds to spread jobs over')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=1, help='callback threads per stage')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help="unacked deliveries per stage consumer (0 keeps the workers' defaults)")
+    parser.add_argument('--fair', action='store_true',
+                        help='schedule every stage with the size-aware fair scheduler instead of FIFO')
+    parser.add_argument('--small-repo-max-mb', type=float, default=1.0,
+                        help='lane threshold for --fair (synthetic repos are far smaller than real ones)')
+    parser.add_argument('--rate', type=float, default=0, help='submitted jobs/sec (0 submits all at once)')
+    parser.add_argument('--firestore-latency-ms', type=float, default=0, help='simulated latency per Firestore call')
+    parser.add_argument('--report-store', choices=('firestore', 'local'), default='firestore',
+                        help='where per-file report chunks go: the fake Firestore or a local directory')
+    parser.add_argument('--advisory-db', help='compiled advisory index to scan against (default: none)')
+    parser.add_argument('--timeout', type=float, default=1800, help='give up after this many seconds')
+    parser.add_argument('--output', help='write the results JSON here')
+    parser.add_argument('--compare', help='baseline results JSON to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='with --compare, exit non-zero if any metric is this much worse (0.2 = 20%%)')
+    parser.add_argument('--verbose', action='store_true', help='show worker logs')
+    args = parser.parse_args()
+
+    # Resolve paths before run() changes into the scratch directory.
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f" [✓] Results written to {output}")
+
+    if baseline:
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f" [!] Regressed past {args.max_regression:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,18 +24,46 @@ interface Job {
     createdAt: Timestamp;
     updatedAt: Timestamp;
     errorDetails?: string;
+    // Per analyzer, updated by the workers each time a chunk of per-file results is stored.
+    progress?: Record<string, {
+        records: number;
+        chunks: number;
+        findings?: number;
+        firstFindings?: { path: string; rule: string; line: number }[];
+    }>;
+    // Summaries only: full per-file results live in the chunks each section points to.
     report?: {
         security?: {
             vulnerabilitiesFound: number;
             details: { id: string; severity: string; package: string }[];
+            truncated?: string[];
+            chunks?: Record<string, ReportChunks>;
         };
         complexity?: {
             cyclomatic: number;
             maintainability: number;
+            truncated?: string[];
+            chunks?: Record<string, ReportChunks>;
         };
     };
 }
 
+// Where a stream of per-file results is stored. Firestore chunks are the
+// documents '<run>-<stream>-00000' onwards under `location`, which is below
+// `owner`: 'results/<key>' for shared analyses, else the job itself. Each one's
+// zlib-compressed `data` decompresses (DecompressionStream('deflate')) to { records: [...] }.
+// Chunks of a superseded run, or of a job without a shared result, are deleted
+// after the workers' retention period, so a missing chunk means they expired.
+interface ReportChunks {
+    store: 'firestore' | 'local' | 'gcs';
+    location: string;
+    owner: string;
+    run: string;
+    stream: string;
+    chunks: number;
+    records: number;
+}
+
 // Main Application Component
 export default function App() {
     // --- State Management ---
@@ -196,6 +224,11 @@ export default function App() {
                                 <p className="font-semibold text-white truncate">{job.repoName || job.repoUrl}</p>
                                 <p className="text-sm text-gray-400">{job.status}</p>
                                 {job.status === 'Error' && <p className="text-xs text-red-400 mt-1 truncate">{job.errorDetails}</p>}
+                                {job.status !== 'Complete' && job.progress && Object.entries(job.progress).map(([stream, p]) => (
+                                    <p key={stream} className="text-xs text-gray-500 mt-1 truncate">
+                                        {stream}: {p.records} files{p.findings ? `, ${p.findings} findings (first in ${p.firstFindings?.[0]?.path})` : ''}
+                                    </p>
+                                ))}
                             </div>
                         </div>
                         <p className="text-sm text-gray-500 flex-shrink-0 ml-4">{job.createdAt ? new Date(job.createdAt.toDate()).toLocaleString() : 'Just now'}</p>
@@ -0,0 +1,150 @@
+# job_cost.py - Estimates how big a job's repository is before it is cloned.
+# The entry stage (the cloner, or the fused pipeline worker) schedules jobs by
+# these estimates; see scheduler.py. Sizes measured by past clones are kept in a
+# small local sqlite file, and repositories never cloned before are probed.
+# Probes run on their own threads and the scheduler only waits for them
+# briefly: a job whose size is still unknown is scheduled as large, and the
+# probe's answer is kept for the repository's next jobs.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from urllib.parse import urlsplit
+
+from repo_cache import normalize_repo_url
+from scheduler import lane_for
+
+# --- Cost Estimation Configuration ---
+COST_HISTORY_PATH = os.environ.get('COST_HISTORY_PATH', 'cost_history.db')
+SIZE_PROBE_TIMEOUT_SECONDS = float(os.environ.get('SIZE_PROBE_TIMEOUT_SECONDS', '3'))
+# How long scheduling a job waits for a probe before treating the repo as large.
+ESTIMATE_WAIT_SECONDS = float(os.environ.get('SIZE_ESTIMATE_WAIT_SECONDS', '0.2'))
+SIZE_PROBE_THREADS = int(os.environ.get('SIZE_PROBE_THREADS', '4'))
+# Directories (os.pathsep-separated) under which file:// repos may be measured.
+# Empty by default: a file:// URL comes straight from the user and could name any path.
+SIZE_PROBE_FILE_ROOTS = [os.path.realpath(root) for root in
+                         os.environ.get('SIZE_PROBE_FILE_ROOTS', '').split(os.pathsep) if root]
+# Optional; raises the GitHub API rate limit of the size probe.
+GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN')
+
+
+def _tree_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def probe_size(repo_url, timeout=SIZE_PROBE_TIMEOUT_SECONDS):
+    """Asks the host how big a repository is without cloning it. Returns bytes, or None if it can't tell.
+
+    git itself has no way to report a remote's size, so this covers GitHub
+    (its REST API reports the size of the repository) and local file:// repos
+    under SIZE_PROBE_FILE_ROOTS.
+    """
+    parts = urlsplit(normalize_repo_url(repo_url))
+    if parts.scheme == 'file':
+        path = os.path.realpath(parts.path)
+        if not any(os.path.commonpath([path, root]) == root for root in SIZE_PROBE_FILE_ROOTS):
+            return None
+        if not os.path.isdir(path):
+            return None
+        git_dir = os.path.join(path, '.git')
+        return _tree_size(git_dir if os.path.isdir(git_dir) else path)
+    if parts.hostname != 'github.com':
+        return None
+    path = parts.path.strip('/').split('/')
+    if len(path) != 2:
+        return None
+    request = urllib.request.Request(f"https://api.github.com/repos/{path[0]}/{path[1]}",
+                                     headers={'Accept': 'application/vnd.github+json'})
+    if GITHUB_TOKEN:
+        request.add_header('Authorization', f"Bearer {GITHUB_TOKEN}")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return int(json.load(response)['size']) * 1024 # Reported in KiB.
+    except Exception as e:
+        print(f" [!] Size probe failed for {repo_url}: {e}")
+        return None
+
+
+class CostEstimator:
+    """Repository sizes by normalized URL: measured after each clone, probed before the first."""
+
+    def __init__(self, path=COST_HISTORY_PATH, probe_timeout=SIZE_PROBE_TIMEOUT_SECONDS,
+                 wait=ESTIMATE_WAIT_SECONDS, probe_threads=SIZE_PROBE_THREADS):
+        self.probe_timeout = probe_timeout
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS repo_sizes (url TEXT PRIMARY KEY, size_bytes INTEGER, source TEXT, updated_at REAL)')
+        self._conn.commit()
+        self._probes = {} # url -> Future, one per repo while its probe runs
+        self._prober = ThreadPoolExecutor(max_workers=probe_threads, thread_name_prefix='size-probe')
+
+    def estimate(self, repo_url):
+        """Returns (size in bytes, source), where source is 'history' or 'probe'.
+
+        Returns (None, 'probing') if a probe is still running after the wait,
+        and (None, 'unknown') if the probe could not tell.
+        """
+        url = normalize_repo_url(repo_url)
+        with self._lock:
+            row = self._conn.execute('SELECT size_bytes FROM repo_sizes WHERE url = ?', (url,)).fetchone()
+            if row:
+                return row[0], 'history'
+            future = self._probes.get(url)
+            if future is None:
+                future = self._probes[url] = self._prober.submit(self._probe, url, repo_url)
+        try:
+            size = future.result(timeout=self.wait)
+        except FutureTimeout:
+            return None, 'probing'
+        return (size, 'probe') if size is not None else (None, 'unknown')
+
+    def _probe(self, url, repo_url):
+        try:
+            size = probe_size(repo_url, self.probe_timeout)
+            if size is not None:
+                # Remember the probe so resubmissions don't repeat it; the first clone overwrites it.
+                self._store(url, size, 'probe')
+            return size
+        finally:
+            with self._lock:
+                self._probes.pop(url, None)
+
+    def record(self, repo_url, size_bytes):
+        """Records the size a clone actually measured."""
+        if size_bytes is not None:
+            self._store(normalize_repo_url(repo_url), size_bytes, 'measured')
+
+    def _store(self, url, size_bytes, source):
+        # A probe that finishes after the first clone must not replace what the clone measured.
+        verb = 'INSERT OR IGNORE' if source == 'probe' else 'INSERT OR REPLACE'
+        with self._lock:
+            self._conn.execute(f'{verb} INTO repo_sizes VALUES (?, ?, ?, ?)',
+                               (url, size_bytes, source, time.time()))
+            self._conn.commit()
+
+
+def analysis_job_classifier(estimator):
+    """Returns a FairScheduler classify function for 'analysis_jobs' payloads."""
+
+    def classify(properties, body):
+        payload = json.loads(body)
+        size, source = estimator.estimate(payload['repoUrl'])
+        lane, cost = lane_for(size)
+        size_text = f"{size / 1024 ** 2:.1f} MiB from {source}" if size is not None else f"size {source}"
+        print(f" [*] Queued {payload['repoUrl']} for {payload['userId']} in the {lane} lane ({size_text}).")
+        return lane, payload['userId'], cost
+
+    return classify
@@ -0,0 +1,213 @@
+# repo_cache.py - Persistent bare-mirror cache used by the cloning worker.
+# The first job for a repo pays for a full network clone into a bare mirror.
+# Later jobs only 'git fetch' the new objects and then make a cheap local clone
+# (hard-linked objects) into their own per-job directory.
+
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+import git # The GitPython library
+
+# --- Cache Configuration ---
+REPO_CACHE_DIR = os.environ.get('REPO_CACHE_DIR', './repo_cache')
+# Disk budget for all mirrors together. Least recently used mirrors are evicted past it.
+REPO_CACHE_MAX_BYTES = int(os.environ.get('REPO_CACHE_MAX_BYTES', str(10 * 1024 ** 3)))
+
+
+def normalize_repo_url(repo_url):
+    """Returns a canonical form of a repo URL so equivalent spellings share one mirror."""
+    url = repo_url.strip()
+    # scp-like syntax: git@github.com:owner/repo.git
+    scp_match = re.match(r'^([\w.-]+@)?([\w.-]+):(?!//)(.+)$', url)
+    if scp_match and '://' not in url:
+        url = f"ssh://{scp_match.group(1) or ''}{scp_match.group(2)}/{scp_match.group(3)}"
+
+    parts = urlsplit(url)
+    if not parts.scheme:
+        # A bare local path.
+        return os.path.abspath(url).rstrip('/')
+
+    scheme = parts.scheme.lower()
+    if scheme == 'file':
+        return urlunsplit(('file', '', os.path.normpath(parts.path), '', ''))
+
+    # Drop credentials, default ports and cosmetic suffixes.
+    host = (parts.hostname or '').lower()
+    if parts.port and not (scheme == 'https' and parts.port == 443) and not (scheme == 'http' and parts.port == 80):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip('/')
+    if path.endswith('.git'):
+        path = path[:-len('.git')]
+    if host in ('github.com', 'gitlab.com', 'bitbucket.org'):
+        # These hosts treat owner/repo case-insensitively.
+        path = path.lower()
+    return urlunsplit((scheme, host, path, '', ''))
+
+
+# What 'git ls-remote' prints for a SHA-1 or SHA-256 repository; same check as dispatch-api.
+_COMMIT_SHA = re.compile(r'^[0-9a-f]{40,64}$')
+
+
+def check_repo_url(repo_url):
+    """Raises ValueError for a repoUrl git could mistake for an option."""
+    if not isinstance(repo_url, str) or not repo_url.strip():
+        raise ValueError('repoUrl must be a non-empty string')
+    if repo_url.lstrip().startswith('-'):
+        raise ValueError(f"Invalid repoUrl '{repo_url}'")
+
+
+def resolve_head(repo_url):
+    """Returns the commit SHA the remote HEAD points at, or None if it cannot be resolved."""
+    check_repo_url(repo_url)
+    g = git.cmd.Git()
+    g.update_environment(GIT_TERMINAL_PROMPT='0')
+    try:
+        # '--' keeps a URL like '--upload-pack=...' from being parsed as an option.
+        output = g.ls_remote('--', repo_url, 'HEAD')
+    except git.GitCommandError as e:
+        print(f" [!] Could not resolve HEAD of {repo_url}: {e}")
+        return None
+    sha = output.split()[0] if output else None
+    return sha if sha and _COMMIT_SHA.match(sha) else None
+
+
+class RepoCache:
+    """Bare-mirror cache keyed by normalized repo URL with LRU eviction under a disk budget."""
+
+    def __init__(self, cache_dir=REPO_CACHE_DIR, max_bytes=REPO_CACHE_MAX_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # flock() only excludes other processes, so threads in this process
+        # serialize on a per-key threading.Lock first.
+        self._thread_locks = {}
+        self._thread_locks_guard = threading.Lock()
+
+    def _key(self, repo_url):
+        normalized = normalize_repo_url(repo_url)
+        slug = re.sub(r'[^A-Za-z0-9._-]+', '_', normalized.rsplit('/', 1)[-1])[:40]
+        digest = hashlib.sha1(normalized.encode()).hexdigest()[:16]
+        return f"{slug}-{digest}"
+
+    def _mirror_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.git")
+
+    def _lock_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.lock")
+
+    @contextmanager
+    def _locked(self, key):
+        """Holds the per-repo lock across threads and processes sharing the cache volume."""
+        with self._thread_locks_guard:
+            thread_lock = self._thread_locks.setdefault(key, threading.Lock())
+        with thread_lock:
+            with open(self._lock_path(key), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _mirror_ok(self, mirror_path):
+        """True if the mirror is a repository whose refs all resolve to objects it has."""
+        try:
+            git.Repo(mirror_path).git.fsck('--connectivity-only', '--no-dangling')
+            return True
+        except (git.GitCommandError, git.InvalidGitRepositoryError, git.NoSuchPathError):
+            return False
+
+    def _refresh_mirror(self, repo_url, mirror_path):
+        """Fetches into an existing mirror, or creates it. Returns True on a cache hit.
+
+        A failed fetch only costs the mirror if the mirror itself is broken;
+        otherwise (remote down, auth, network) the error is raised and the
+        mirror kept for the next job.
+        """
+        if os.path.isdir(mirror_path):
+            try:
+                git.Repo(mirror_path).git.fetch('--prune', '--force', 'origin')
+                return True
+            except (git.GitCommandError, git.InvalidGitRepositoryError, git.NoSuchPathError) as e:
+                if self._mirror_ok(mirror_path):
+                    raise
+                # A corrupt or half-written mirror is cheaper to rebuild than to repair.
+                print(f" [!] Mirror is corrupt, re-cloning: {e}")
+                shutil.rmtree(mirror_path, ignore_errors=True)
+
+        partial_path = f"{mirror_path}.partial"
+        shutil.rmtree(partial_path, ignore_errors=True)
+        git.Repo.clone_from(repo_url, partial_path, mirror=True)
+        os.rename(partial_path, mirror_path)
+        return False
+
+    def checkout(self, repo_url, dest_dir, commit_sha=None):
+        """Materializes a working tree of repo_url into dest_dir, refreshing the mirror first.
+
+        Returns True if the mirror was already cached (incremental fetch), False on a cold clone.
+        """
+        check_repo_url(repo_url)
+        key = self._key(repo_url)
+        mirror_path = self._mirror_path(key)
+
+        with self._locked(key):
+            hit = self._refresh_mirror(repo_url, mirror_path)
+            # Touching the mirror records its last use for LRU eviction.
+            os.utime(mirror_path, None)
+
+            if os.path.exists(dest_dir):
+                shutil.rmtree(dest_dir)
+            # A local clone hard-links the object files, so it costs no network
+            # and almost no disk, and stays valid if the mirror is evicted later.
+            repo = git.Repo.clone_from(mirror_path, dest_dir)
+            repo.remotes.origin.set_url(repo_url)
+            if commit_sha:
+                repo.git.checkout('--detach', commit_sha)
+
+        self.evict()
+        return hit
+
+    def mirror_size(self, repo_url):
+        """Returns the on-disk size of repo_url's mirror in bytes, or None if it is not cached."""
+        mirror_path = self._mirror_path(self._key(repo_url))
+        return self._mirror_size(mirror_path) if os.path.isdir(mirror_path) else None
+
+    def _mirror_size(self, mirror_path):
+        total = 0
+        for dirpath, _, filenames in os.walk(mirror_path):
+            for filename in filenames:
+                try:
+                    total += os.lstat(os.path.join(dirpath, filename)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def evict(self):
+        """Deletes least recently used mirrors until the cache fits in its disk budget."""
+        mirrors = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir() and entry.name.endswith('.git'):
+                mirrors.append((entry.stat().st_mtime, entry.name[:-len('.git')], entry.path))
+
+        total = sum(self._mirror_size(path) for _, _, path in mirrors)
+        for _, key, path in sorted(mirrors):
+            if total <= self.max_bytes:
+                break
+            with open(self._lock_path(key), 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Someone is fetching or checking out from it right now.
+                    continue
+                try:
+                    size = self._mirror_size(path)
+                    shutil.rmtree(path, ignore_errors=True)
+                    total -= size
+                    print(f" [-] Evicted cached mirror {key} ({size} bytes)")
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,110 @@
+# blob_cache.py - Content-addressed cache of per-file analyzer results.
+# Used by the security and complexity analyzers.
+#
+# Results are keyed by (git blob SHA, analyzer, analyzer version), so a file
+# that did not change between two commits, or that appears in two repos, is
+# only ever analyzed once. Entries live in a local sqlite file and the least
+# recently used ones are evicted past a size budget.
+
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+import zlib
+
+BLOB_CACHE_PATH = os.environ.get('BLOB_CACHE_PATH', 'blob_cache.db')
+BLOB_CACHE_MAX_BYTES = int(os.environ.get('BLOB_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+
+# sqlite limits the number of bound parameters per statement.
+_QUERY_CHUNK = 500
+
+
+def blob_shas(root):
+    """Returns {relative path: blob SHA} for the tracked files of a git checkout."""
+    output = subprocess.run(['git', 'ls-files', '--stage', '-z'], cwd=root, check=True,
+                            stdout=subprocess.PIPE).stdout
+    shas = {}
+    for record in output.split(b'\0'):
+        if record:
+            info, path = record.split(b'\t', 1)
+            shas[path.decode('utf-8', errors='surrogateescape')] = info.split(b' ')[1].decode()
+    return shas
+
+
+class BlobCache:
+    """sqlite-backed (blob SHA, analyzer, version) -> result store. Safe to share between threads."""
+
+    def __init__(self, path=BLOB_CACHE_PATH, max_bytes=BLOB_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            ' blob_sha TEXT, analyzer TEXT, version TEXT, value BLOB, size INTEGER, last_used REAL,'
+            ' PRIMARY KEY (blob_sha, analyzer, version))')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self._conn.commit()
+        self._total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    def get_many(self, analyzer, version, keys):
+        """Returns {key: result} for every (blob SHA, analyzer kind) key that is cached.
+
+        keys are (blob_sha, kind) pairs; kind refines the analyzer when its result
+        also depends on the file name (e.g. the extension), and may be ''.
+        """
+        keys = list(keys)
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), _QUERY_CHUNK):
+                chunk = keys[start:start + _QUERY_CHUNK]
+                placeholders = ','.join('(?, ?)' for _ in chunk)
+                params = [value for blob_sha, kind in chunk for value in (blob_sha, f"{analyzer}{kind}")]
+                rows = self._conn.execute(
+                    f"SELECT blob_sha, analyzer, value FROM results WHERE version = ? AND (blob_sha, analyzer) IN (VALUES {placeholders})",
+                    [version] + params).fetchall()
+                for blob_sha, full_analyzer, value in rows:
+                    found[(blob_sha, full_analyzer[len(analyzer):])] = json.loads(zlib.decompress(value))
+            if found:
+                self._conn.executemany(
+                    'UPDATE results SET last_used = ? WHERE blob_sha = ? AND analyzer = ? AND version = ?',
+                    [(now, blob_sha, f"{analyzer}{kind}", version) for blob_sha, kind in found])
+                self._conn.commit()
+        return found
+
+    def put_many(self, analyzer, version, items):
+        """Stores {(blob_sha, kind): result} and evicts old entries if over budget."""
+        now = time.time()
+        rows = []
+        for (blob_sha, kind), result in items.items():
+            value = zlib.compress(json.dumps(result, separators=(',', ':')).encode())
+            rows.append((blob_sha, f"{analyzer}{kind}", version, value, len(value), now))
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._conn.commit()
+            self._total += sum(row[4] for row in rows)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drops least recently used entries down to 90% of the budget. Called with the lock held."""
+        self._total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        target = self.max_bytes * 0.9
+        if self._total <= target:
+            return
+        freed = 0
+        doomed = []
+        for rowid, size in self._conn.execute('SELECT rowid, size FROM results ORDER BY last_used'):
+            if self._total - freed <= target:
+                break
+            doomed.append((rowid,))
+            freed += size
+        self._conn.executemany('DELETE FROM results WHERE rowid = ?', doomed)
+        self._conn.commit()
+        self._total -= freed
+        print(f" [-] Evicted {len(doomed)} cached blob results ({freed} bytes)")
@@ -0,0 +1,52 @@
+# checkout_files.py - Reading files of an untrusted checkout.
+# Used by the security and complexity analyzers.
+#
+# A checkout is user content. A tracked symlink can point anywhere on the host
+# (or at /dev/zero), so sizes are taken without following links and a file is
+# opened with O_NOFOLLOW and O_NONBLOCK (a FIFO must not hang the open). Its
+# type and size are checked again on the open descriptor, since the path may
+# have changed since the tree was walked.
+
+import errno
+import os
+import stat
+from contextlib import contextmanager
+
+_OPEN_FLAGS = os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_NONBLOCK', 0) | getattr(os, 'O_BINARY', 0)
+
+NOT_REGULAR = 'not a regular file'
+TOO_LARGE = 'too large'
+
+
+class SkippedFile(Exception):
+    """A checkout path that must not be read; str() is the reason."""
+
+
+def regular_size(path):
+    """The size of path if it is a regular file itself (not a link to one), else None."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    return st.st_size if stat.S_ISREG(st.st_mode) else None
+
+
+@contextmanager
+def open_regular(path, max_bytes):
+    """Opens a regular file of a checkout for binary reading and yields (file, size).
+
+    Raises SkippedFile for symlinks, devices, FIFOs and files over max_bytes.
+    """
+    try:
+        fd = os.open(path, _OPEN_FLAGS)
+    except OSError as e:
+        if e.errno == errno.ELOOP:
+            raise SkippedFile(NOT_REGULAR) from None
+        raise
+    with os.fdopen(fd, 'rb') as f:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            raise SkippedFile(NOT_REGULAR)
+        if st.st_size > max_bytes:
+            raise SkippedFile(TOO_LARGE)
+        yield f, st.st_size
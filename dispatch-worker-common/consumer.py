@@ -0,0 +1,141 @@
+# consumer.py - Concurrent RabbitMQ consumption for the pipeline workers.
+# Used by every Python worker.
+#
+# The connection thread only moves bytes: it receives deliveries, keeps
+# heartbeats flowing, and performs the acks and publishes that callbacks
+# running on the worker pool hand back to it.
+
+import functools
+import os
+import signal
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Concurrency Configuration ---
+# How many jobs this process works on at once.
+WORKER_CONCURRENCY = max(1, int(os.environ.get('WORKER_CONCURRENCY', '1')))
+# How many unacknowledged deliveries RabbitMQ may push to us. Defaults to one per pool slot.
+WORKER_PREFETCH = int(os.environ.get('WORKER_PREFETCH', '0')) or WORKER_CONCURRENCY
+
+
+class ThreadSafeChannel:
+    """Stands in for the channel inside callbacks that run on pool threads.
+
+    pika channels may only be used from the connection's thread, so acks and
+    publishes are queued onto it with add_callback_threadsafe. They run in the
+    order they were requested, so a publish issued before an ack is sent first.
+    """
+
+    def __init__(self, connection, channel):
+        self._connection = connection
+        self._channel = channel
+        self._connection_thread = threading.current_thread()
+
+    def _call(self, fn, *args, **kwargs):
+        if threading.current_thread() is self._connection_thread:
+            fn(*args, **kwargs)
+        else:
+            self._connection.add_callback_threadsafe(functools.partial(fn, *args, **kwargs))
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        self._call(self._channel.basic_ack, delivery_tag=delivery_tag, multiple=multiple)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self._call(self._channel.basic_nack, delivery_tag=delivery_tag, multiple=multiple, requeue=requeue)
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, mandatory=False):
+        self._call(self._channel.basic_publish, exchange=exchange, routing_key=routing_key,
+                   body=body, properties=properties, mandatory=mandatory)
+
+
+def consume(connection, channel, queues, callback, concurrency=WORKER_CONCURRENCY, prefetch=WORKER_PREFETCH,
+            scheduler=None, admission=None, stopping=None):
+    """Consumes one queue or a list of them with up to `concurrency` callbacks in flight until SIGINT/SIGTERM.
+
+    Each queue gets its own consumer and `prefetch` window.
+
+    callback has the usual pika signature (ch, method, properties, body); ch is a
+    ThreadSafeChannel. On shutdown, deliveries that have not started are released
+    back to the broker and in-flight jobs are allowed to finish.
+
+    With a scheduler (see scheduler.py), deliveries are handed to it instead of
+    run in arrival order, and its slots replace `concurrency`. With an
+    Admission, its queue is consumed as well and its deliveries are routed
+    into lane queues instead of run.
+
+    stopping, if given, is a threading.Event that ends consumption instead of
+    the signals, for running consume() off the main thread (e.g. in the bench).
+    """
+    if stopping is None:
+        stopping = threading.Event()
+
+        def request_stop(signum, frame):
+            print(f" [*] Received signal {signum}, finishing in-flight jobs...")
+            stopping.set()
+
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+
+    if isinstance(queues, str):
+        queues = [queues]
+    safe_channel = ThreadSafeChannel(connection, channel)
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='job') if scheduler is None else None
+    in_flight = set()
+
+    def run(method, properties, body):
+        try:
+            callback(safe_channel, method, properties, body)
+        except Exception:
+            # Callbacks handle their own errors; anything escaping is a bug, not a job failure.
+            print(f" [!] Unhandled error in callback for delivery {method.delivery_tag}:")
+            traceback.print_exc()
+
+    def on_message(ch, method, properties, body):
+        if scheduler is not None:
+            scheduler.submit((method, properties, body), properties, body)
+            return
+        future = pool.submit(run, method, properties, body)
+        in_flight.add(future)
+        future.add_done_callback(in_flight.discard)
+        if future.done():
+            # It may have finished before it was added to the set.
+            in_flight.discard(future)
+
+    def on_submission(ch, method, properties, body):
+        admission.submit(safe_channel, method, properties, body)
+
+    if scheduler is not None:
+        scheduler.start(lambda task: run(*task))
+    # basic_qos applies to each consumer started after it, so every queue gets a window of its own.
+    consumer_tags = []
+    if admission is not None:
+        channel.basic_qos(prefetch_count=admission.prefetch)
+        consumer_tags.append(channel.basic_consume(queue=admission.queue, on_message_callback=on_submission))
+    channel.basic_qos(prefetch_count=prefetch)
+    for queue in queues:
+        consumer_tags.append(channel.basic_consume(queue=queue, on_message_callback=on_message))
+
+    # Polling (instead of start_consuming) lets the signal handler only flip a flag.
+    while not stopping.is_set():
+        connection.process_data_events(time_limit=1)
+
+    for consumer_tag in consumer_tags:
+        channel.basic_cancel(consumer_tag)
+    # Prefetched jobs that have not started go back to the queue when we disconnect.
+    if admission is not None:
+        admission.stop()
+    if scheduler is not None:
+        scheduler.stop()
+        while scheduler.busy():
+            connection.process_data_events(time_limit=0.2)
+    else:
+        for future in list(in_flight):
+            future.cancel()
+        while any(not future.done() for future in list(in_flight)):
+            connection.process_data_events(time_limit=0.2)
+        pool.shutdown(wait=True)
+    # Flush the acks and publishes queued by the last callbacks.
+    connection.process_data_events(time_limit=0)
+    connection.close()
+    print(' [*] Worker stopped.')
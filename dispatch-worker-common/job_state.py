@@ -0,0 +1,248 @@
+# job_state.py - Write-behind Firestore writer for job documents.
+# Used by every Python worker.
+#
+# Status updates are queued instead of written inline. Consecutive updates for
+# the same job are merged into one write, and a background thread commits them
+# with Firestore batch writes, so the consumer thread never waits on Firestore
+# unless it explicitly asks to (terminal states and hand-offs to the next stage).
+
+import atexit
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# --- Flush Window ---
+# A pending write waits at most this long before it is committed.
+FLUSH_INTERVAL_SECONDS = float(os.environ.get('STATE_FLUSH_INTERVAL_SECONDS', '0.5'))
+# Flush early once this many jobs have pending writes. Firestore caps a batch at 500.
+MAX_BATCH = min(500, int(os.environ.get('STATE_MAX_BATCH', '100')))
+# How many times a failed write is retried before it is dropped.
+MAX_RETRIES = 3
+# Job IDs become document IDs and clone directory names.
+_JOB_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def _apply_update(data, fields):
+    """Applies update()-style fields (with dotted paths) onto a set()-style nested dict."""
+    for path, value in fields.items():
+        target = data
+        keys = path.split('.')
+        for key in keys[:-1]:
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            target = target[key]
+        target[keys[-1]] = value
+
+
+class _PendingWrite:
+    def __init__(self, kind, data):
+        self.kind = kind # 'set' or 'update'
+        self.data = data
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+        self.waiters = []
+
+    def merge(self, kind, data):
+        """Folds a later write for the same document into this one."""
+        if kind == 'set':
+            self.kind, self.data = 'set', dict(data)
+        elif self.kind == 'set':
+            _apply_update(self.data, data)
+        else:
+            self.data.update(data)
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.error = None
+
+
+class JobStateWriter:
+    """Coalesces and batches writes to the 'jobs' collection on a background thread."""
+
+    def __init__(self, db, collection='jobs', flush_interval=FLUSH_INTERVAL_SECONDS, max_batch=MAX_BATCH,
+                 on_commit=None):
+        self.db = db
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        # Called with the seconds each batch commit took, for latency metrics.
+        self.on_commit = on_commit
+        self._pending = OrderedDict() # job_id -> _PendingWrite, oldest first
+        self._inflight = [] # the batch currently being committed
+        self._urgent = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='job-state-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def new_id(self):
+        """Generates a job ID client-side, without a round-trip."""
+        return self.db.collection(self.collection).document().id
+
+    def submitted_id(self, payload):
+        """The job ID the API minted for a submission, or a new one if the producer set none.
+
+        A redelivered submission keeps its ID, so it resumes the same job and the
+        same result claim instead of starting a second one.
+        """
+        job_id = payload.get('jobId')
+        if job_id is None:
+            return self.new_id()
+        if not isinstance(job_id, str) or not _JOB_ID.match(job_id):
+            raise ValueError(f"Invalid jobId {job_id!r}")
+        return job_id
+
+    def create(self, data, job_id=None, wait=False):
+        """Queues a new job document and returns its ID (generated here unless given)."""
+        job_id = job_id or self.new_id()
+        self._enqueue(job_id, 'set', data, wait)
+        return job_id
+
+    def update(self, job_id, fields, wait=False):
+        """Queues an update for a job document.
+
+        With wait=True this blocks until the write (and any earlier pending write for
+        the job) is committed, and raises if it could not be. Use it for terminal
+        states and before handing the job to the next stage.
+        """
+        self._enqueue(job_id, 'update', fields, wait)
+
+    def flush(self):
+        """Blocks until every write queued so far has been attempted at least once."""
+        with self._cond:
+            waiters = []
+            for _, pending in self._inflight + list(self._pending.items()):
+                waiter = _Waiter()
+                pending.waiters.append(waiter)
+                waiters.append(waiter)
+            self._urgent = True
+            self._cond.notify()
+        for waiter in waiters:
+            waiter.event.wait()
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _enqueue(self, job_id, kind, data, wait):
+        waiter = _Waiter() if wait else None
+        with self._cond:
+            pending = self._pending.get(job_id)
+            if pending is None:
+                pending = self._pending[job_id] = _PendingWrite(kind, dict(data))
+            else:
+                pending.merge(kind, data)
+            if waiter:
+                pending.waiters.append(waiter)
+                self._urgent = True
+            if waiter or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        if waiter:
+            waiter.event.wait()
+            if waiter.error:
+                raise waiter.error
+
+    def _take_batch(self):
+        """Waits for a flush trigger and pops up to max_batch pending writes. Called with the lock held."""
+        while True:
+            if self._pending:
+                oldest = next(iter(self._pending.values()))
+                due = oldest.queued_at + self.flush_interval
+                if self._urgent or len(self._pending) >= self.max_batch or time.monotonic() >= due:
+                    break
+                self._cond.wait(due - time.monotonic())
+            elif self._closed:
+                return None
+            else:
+                self._cond.wait()
+
+        batch = []
+        while self._pending and len(batch) < self.max_batch:
+            batch.append(self._pending.popitem(last=False))
+        self._urgent = any(p.waiters for p in self._pending.values())
+        self._inflight = batch
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if batch is None:
+                return
+            started = time.monotonic()
+            failed = self._commit(batch)
+            if self.on_commit:
+                self.on_commit(time.monotonic() - started)
+            failed_ids = {job_id for (job_id, _), _ in failed}
+            with self._cond:
+                self._inflight = []
+                for job_id, pending in batch:
+                    if job_id not in failed_ids:
+                        for waiter in pending.waiters:
+                            waiter.event.set()
+                for item, error in failed:
+                    self._requeue(item, error)
+                self._urgent = any(p.waiters for p in self._pending.values())
+            if failed:
+                # Back off a little before trying again.
+                time.sleep(min(1.0, self.flush_interval))
+
+    def _write(self, batch):
+        write_batch = self.db.batch()
+        for job_id, pending in batch:
+            doc_ref = self.db.collection(self.collection).document(job_id)
+            if pending.kind == 'set':
+                write_batch.set(doc_ref, pending.data)
+            else:
+                write_batch.update(doc_ref, pending.data)
+        write_batch.commit()
+
+    def _commit(self, batch):
+        """Commits a batch. Returns [(item, error)] for the writes that failed."""
+        try:
+            self._write(batch)
+            return []
+        except Exception as e:
+            if len(batch) == 1:
+                print(f" [!] Job state write failed for {batch[0][0]}: {e}")
+                return [(batch[0], e)]
+            print(f" [!] Batched job state write failed, retrying {len(batch)} writes one by one: {e}")
+        # A batch is atomic, so one bad document (e.g. an update to a deleted job)
+        # would otherwise sink every other write in it.
+        failed = []
+        for item in batch:
+            try:
+                self._write([item])
+            except Exception as e:
+                print(f" [!] Job state write failed for {item[0]}: {e}")
+                failed.append((item, e))
+        return failed
+
+    def _requeue(self, item, error):
+        """Puts a failed write back underneath anything queued since, or gives up on it. Called with the lock held."""
+        job_id, pending = item
+        pending.attempts += 1
+        # Callers waiting on the write get the error right away rather than stalling.
+        for waiter in pending.waiters:
+            waiter.error = error
+            waiter.event.set()
+        pending.waiters = []
+        if pending.attempts >= MAX_RETRIES:
+            print(f" [!] Dropping job state write for {job_id} after {pending.attempts} attempts.")
+            return
+        newer = self._pending.pop(job_id, None)
+        if newer is not None:
+            pending.merge(newer.kind, newer.data)
+            pending.waiters.extend(newer.waiters)
+        self._pending[job_id] = pending
+        self._pending.move_to_end(job_id, last=False)
@@ -0,0 +1,418 @@
+# report_store.py - Chunked, compressed storage for per-file analyzer results.
+# Used by the security and complexity analyzers.
+#
+# A job document only keeps a compact summary of each report: the totals, the
+# first few findings and a manifest of where everything else went. Per-file
+# results are streamed into zlib-compressed JSON chunks while the analyzer is
+# still running, so a report is no longer bounded by Firestore's 1 MiB
+# document limit and a UI read of the job list never pulls whole reports.
+# Every chunk that lands also updates 'progress.<stream>' on the job document,
+# which lets the UI show how far along a job is and its first findings.
+#
+# Chunks belong to an owner document: 'results/<result key>' for jobs that run
+# a shared analysis, so the followers and later cache hits that copy the
+# summary read chunks that are not inside another user's job, and only a job
+# without a result key owns its chunks itself ('jobs/<job id>'). They go to a
+# 'reportChunks' subcollection of the owner by default, to a local directory,
+# or to a Cloud Storage bucket (REPORT_STORE). Chunk names are
+# '<run>-<stream>-<seq>', where the run is the job that wrote them, numbered
+# from 0, so a manifest only needs the chunk count and a re-run never mixes
+# its chunks with an earlier one's. A chunk decompresses to {"records": [...]};
+# browsers can read it with DecompressionStream('deflate').
+#
+# Chunks are deleted by run. A failed run's chunks go as soon as it fails.
+# Those of a run a newer one superseded (see result_cache.py), or of a job
+# without a result key once it completes, are entered in the expired-runs
+# ledger and deleted by ReportRetention's sweep after REPORT_RETENTION_DAYS;
+# the summaries on the job documents are kept.
+
+import json
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+
+from result_cache import (EXPIRED_RUNS_COLLECTION, REPORT_RETENTION_SECONDS, RESULTS_COLLECTION,
+                          expired_run, expired_run_ref)
+
+# --- Report Store Configuration ---
+# 'firestore', 'local' or 'gcs'.
+REPORT_STORE = os.environ.get('REPORT_STORE', 'firestore')
+REPORT_STORE_DIR = os.environ.get('REPORT_STORE_DIR', 'reports')
+# Defaults to the Firebase project's storage bucket.
+REPORT_STORE_BUCKET = os.environ.get('REPORT_STORE_BUCKET')
+# A chunk is cut after this many records, or earlier once its JSON reaches
+# REPORT_CHUNK_MAX_BYTES. Compressed, that stays far below the document limit.
+CHUNK_RECORDS = int(os.environ.get('REPORT_CHUNK_RECORDS', '200'))
+CHUNK_MAX_BYTES = int(os.environ.get('REPORT_CHUNK_MAX_BYTES', str(512 * 1024)))
+# How many entries of each list the summary on the job document keeps.
+PREVIEW_SIZE = int(os.environ.get('REPORT_PREVIEW_SIZE', '20'))
+# Threads compressing and writing chunks, shared by every job in the process.
+WRITE_THREADS = int(os.environ.get('REPORT_WRITE_THREADS', '4'))
+# How often each worker deletes the expired runs that are due.
+GC_INTERVAL_SECONDS = float(os.environ.get('REPORT_GC_INTERVAL_SECONDS', '3600'))
+# Expired runs deleted per ledger query.
+GC_BATCH = 100
+
+CHUNKS_COLLECTION = 'reportChunks'
+ENCODING = 'zlib+json'
+
+_write_pool = ThreadPoolExecutor(max_workers=WRITE_THREADS, thread_name_prefix='report-chunks')
+
+
+def chunk_name(run, stream, seq):
+    return f"{run}-{stream}-{seq:05d}"
+
+
+def run_of(name):
+    """The run a chunk name belongs to, or None if it is not a chunk name."""
+    parts = name.rsplit('-', 2)
+    return parts[0] if len(parts) == 3 and parts[2].isdigit() else None
+
+
+def report_owner(job_id, result_key=None):
+    """The document a job's chunks belong to: its shared result if it has one, else the job itself."""
+    return f"{RESULTS_COLLECTION}/{result_key}" if result_key else f"jobs/{job_id}"
+
+
+def encode_chunk(records_json):
+    """Compresses a list of already JSON-encoded records into one chunk."""
+    return zlib.compress(('{"records":[' + ','.join(records_json) + ']}').encode(), 6)
+
+
+def decode_chunk(data):
+    return json.loads(zlib.decompress(data))['records']
+
+
+class FirestoreChunkStore:
+    """Chunks as documents under <owner>/reportChunks, e.g. results/<key>/reportChunks."""
+
+    kind = 'firestore'
+
+    def __init__(self, db):
+        self.db = db
+
+    def _chunks(self, owner):
+        collection, document = owner.split('/')
+        return self.db.collection(collection).document(document).collection(CHUNKS_COLLECTION)
+
+    def location(self, owner):
+        return f"{owner}/{CHUNKS_COLLECTION}"
+
+    def put(self, owner, name, data, meta):
+        self._chunks(owner).document(name).set({**meta, 'data': data, 'createdAt': firestore.SERVER_TIMESTAMP})
+
+    def get(self, owner, name):
+        return self._chunks(owner).document(name).get().get('data')
+
+    def delete_run(self, owner, run):
+        """Deletes every chunk of run under owner and returns how many there were."""
+        refs = [ref for ref in self._chunks(owner).list_documents() if run_of(ref.id) == run]
+        # A batch takes at most 500 writes.
+        for start in range(0, len(refs), 500):
+            batch = self.db.batch()
+            for ref in refs[start:start + 500]:
+                batch.delete(ref)
+            batch.commit()
+        return len(refs)
+
+
+class LocalChunkStore:
+    """Chunks as files under <root>/<owner>/, for single-host deployments and tests."""
+
+    kind = 'local'
+
+    def __init__(self, root=REPORT_STORE_DIR):
+        self.root = root
+
+    def _path(self, owner, name):
+        return os.path.join(self.root, owner, f"{name}.json.z")
+
+    def location(self, owner):
+        return os.path.abspath(os.path.join(self.root, owner))
+
+    def put(self, owner, name, data, meta):
+        path = self._path(owner, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside and renamed, so a reader never sees half a chunk.
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, owner, name):
+        with open(self._path(owner, name), 'rb') as f:
+            return f.read()
+
+    def delete_run(self, owner, run):
+        directory = os.path.join(self.root, owner)
+        try:
+            filenames = os.listdir(directory)
+        except FileNotFoundError:
+            return 0
+        deleted = 0
+        for filename in filenames:
+            # Leftover '.tmp' files of a failed write go too.
+            if run_of(filename.split('.', 1)[0]) == run:
+                os.remove(os.path.join(directory, filename))
+                deleted += 1
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass # Other runs' chunks are still in it.
+        return deleted
+
+
+class GcsChunkStore:
+    """Chunks as objects under reports/<owner>/ in a Cloud Storage bucket."""
+
+    kind = 'gcs'
+
+    def __init__(self, bucket_name=REPORT_STORE_BUCKET, prefix='reports'):
+        from firebase_admin import storage
+        self.bucket = storage.bucket(bucket_name)
+        self.prefix = prefix
+
+    def _blob(self, owner, name):
+        return self.bucket.blob(f"{self.prefix}/{owner}/{name}.json.z")
+
+    def location(self, owner):
+        return f"gs://{self.bucket.name}/{self.prefix}/{owner}"
+
+    def put(self, owner, name, data, meta):
+        blob = self._blob(owner, name)
+        blob.metadata = {key: str(value) for key, value in meta.items()}
+        blob.upload_from_string(data, content_type='application/octet-stream')
+
+    def get(self, owner, name):
+        return self._blob(owner, name).download_as_bytes()
+
+    def delete_run(self, owner, run):
+        blobs = [blob for blob in self.bucket.list_blobs(prefix=f"{self.prefix}/{owner}/{run}-")
+                 if run_of(blob.name.rsplit('/', 1)[-1].split('.', 1)[0]) == run]
+        if blobs:
+            self.bucket.delete_blobs(blobs)
+        return len(blobs)
+
+
+def open_store(db, kind=REPORT_STORE):
+    """Returns the chunk store REPORT_STORE selects."""
+    if kind == 'firestore':
+        return FirestoreChunkStore(db)
+    if kind == 'local':
+        return LocalChunkStore()
+    if kind == 'gcs':
+        return GcsChunkStore()
+    raise ValueError(f"Unknown REPORT_STORE '{kind}' (expected firestore, local or gcs)")
+
+
+class ReportRetention:
+    """Deletes chunk runs no report points at any more, through the expired-runs ledger."""
+
+    def __init__(self, db, store, retention_seconds=REPORT_RETENTION_SECONDS):
+        self.db = db
+        self.store = store
+        self.retention_seconds = retention_seconds
+
+    def expire(self, owner, run):
+        """Schedules a run's chunks for deletion after the retention period. Best effort."""
+        try:
+            expired_run_ref(self.db, owner, run).set(expired_run(owner, run, self.retention_seconds))
+        except Exception as e:
+            print(f" [!] Could not schedule report chunks of run {run} for deletion: {e}")
+
+    def discard(self, owner, run):
+        """Deletes the chunks of a failed run now. Best effort.
+
+        The run stays in the ledger, due at once, so the next sweep also
+        catches chunks whose writes were still in flight.
+        """
+        try:
+            expired_run_ref(self.db, owner, run).set(expired_run(owner, run, 0))
+            self.store.delete_run(owner, run)
+        except Exception as e:
+            print(f" [!] Could not delete report chunks of run {run}: {e}")
+
+    def sweep(self, batch_size=GC_BATCH):
+        """Deletes the runs that are due and their ledger entries. Returns how many runs it deleted."""
+        swept = 0
+        while True:
+            due = list(self.db.collection(EXPIRED_RUNS_COLLECTION)
+                       .where(filter=firestore.FieldFilter('expiresAt', '<=', time.time()))
+                       .limit(batch_size).stream())
+            for snapshot in due:
+                entry = snapshot.to_dict()
+                self.store.delete_run(entry['owner'], entry['run'])
+                expired_run_ref(self.db, entry['owner'], entry['run']).delete()
+            swept += len(due)
+            if len(due) < batch_size:
+                return swept
+
+    def watch(self, interval=GC_INTERVAL_SECONDS):
+        """Sweeps now and then every interval seconds, on a daemon thread."""
+
+        def watch():
+            while True:
+                try:
+                    swept = self.sweep()
+                    if swept:
+                        print(f" [✓] Deleted report chunks of {swept} expired run(s).")
+                except Exception as e:
+                    print(f" [!] Could not delete expired report chunks: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=watch, name='report-retention', daemon=True).start()
+
+
+def read_records(store, manifest):
+    """Yields the records of a stream from its manifest, chunk by chunk."""
+    if manifest['store'] != store.kind:
+        raise ValueError(f"Report stream is in a '{manifest['store']}' store, not '{store.kind}'")
+    for seq in range(manifest['chunks']):
+        yield from decode_chunk(store.get(manifest['owner'], chunk_name(manifest['run'], manifest['stream'], seq)))
+
+
+class ReportWriter:
+    """Streams one job's records of one kind into chunks under owner as they fill up.
+
+    add() only encodes the record; compressing and writing a full chunk happen
+    on the shared write pool, so analyzers never wait on storage. After each
+    chunk is written, on_progress gets the stream's progress dict. findings,
+    if given, maps a record to its findings, the first of which are included
+    in the progress. Call close() once, after the last add().
+    """
+
+    def __init__(self, store, owner, run, stream, on_progress=None, findings=None,
+                 chunk_records=CHUNK_RECORDS, chunk_max_bytes=CHUNK_MAX_BYTES, preview_size=PREVIEW_SIZE):
+        self.store = store
+        self.owner = owner
+        self.run = run
+        self.stream = stream
+        self.on_progress = on_progress
+        self.findings = findings
+        self.chunk_records = chunk_records
+        self.chunk_max_bytes = chunk_max_bytes
+        self.preview_size = preview_size
+        self._lock = threading.Lock()
+        self._buffer = [] # JSON-encoded records of the chunk being filled
+        self._buffer_bytes = 0
+        self._next_seq = 0
+        self._futures = []
+        self._records_seen = 0
+        self._findings_seen = 0
+        self._first_findings = []
+        self._chunks_written = 0
+        self._records_written = 0
+        self._bytes_written = 0
+
+    def add(self, record):
+        encoded = json.dumps(record, separators=(',', ':'))
+        found = self.findings(record) if self.findings else ()
+        with self._lock:
+            self._buffer.append(encoded)
+            self._buffer_bytes += len(encoded)
+            self._records_seen += 1
+            self._findings_seen += len(found)
+            if len(self._first_findings) < self.preview_size:
+                self._first_findings.extend(found[:self.preview_size - len(self._first_findings)])
+            if len(self._buffer) >= self.chunk_records or self._buffer_bytes >= self.chunk_max_bytes:
+                self._cut()
+
+    def add_all(self, records):
+        for record in records:
+            self.add(record)
+
+    def _cut(self):
+        """Hands the buffered records to the write pool. Called with the lock held."""
+        if not self._buffer:
+            return
+        seq = self._next_seq
+        self._next_seq += 1
+        self._futures.append(_write_pool.submit(self._write, seq, self._buffer))
+        self._buffer = []
+        self._buffer_bytes = 0
+
+    def _write(self, seq, records_json):
+        data = encode_chunk(records_json)
+        self.store.put(self.owner, chunk_name(self.run, self.stream, seq), data, {
+            'stream': self.stream,
+            'seq': seq,
+            'records': len(records_json),
+            'encoding': ENCODING,
+        })
+        with self._lock:
+            self._chunks_written += 1
+            self._records_written += len(records_json)
+            self._bytes_written += len(data)
+            # Reported under the lock, so progress never goes backwards.
+            if self.on_progress:
+                self.on_progress(self._progress())
+
+    def _progress(self):
+        progress = {'records': self._records_written, 'chunks': self._chunks_written}
+        if self.findings:
+            progress['findings'] = self._findings_seen
+            progress['firstFindings'] = list(self._first_findings)
+        return progress
+
+    def close(self):
+        """Writes the last partial chunk, waits for every write and returns the stream's manifest.
+
+        Raises the first error a chunk write hit: a report with a hole in it is not complete.
+        """
+        with self._lock:
+            self._cut()
+            futures = self._futures
+        for future in futures:
+            future.result()
+        return {
+            'store': self.store.kind,
+            'location': self.store.location(self.owner),
+            'owner': self.owner,
+            'run': self.run,
+            'stream': self.stream,
+            'encoding': ENCODING,
+            'chunks': self._next_seq,
+            'records': self._records_seen,
+            'bytes': self._bytes_written,
+        }
+
+
+def progress_updater(job_writer, job_id, stream):
+    """An on_progress callback that queues the progress as 'progress.<stream>' on the job document."""
+
+    def update(progress):
+        job_writer.update(job_id, {f"progress.{stream}": progress, 'updatedAt': firestore.SERVER_TIMESTAMP})
+
+    return update
+
+
+def write_records(store, owner, run, stream, records):
+    """Writes a finished list of records as one stream and returns its manifest."""
+    writer = ReportWriter(store, owner, run, stream)
+    writer.add_all(records)
+    return writer.close()
+
+
+def summarize(report, streams, drop=(), preview_size=PREVIEW_SIZE):
+    """Returns the compact form of a report dict to keep on the job document.
+
+    Keys in drop are left out entirely (their data lives in the streams), and
+    any other list is cut to its first preview_size entries and named in
+    'truncated'. streams ({name: manifest}) says where the full data is.
+    """
+    summary = {}
+    truncated = []
+    for key, value in report.items():
+        if key in drop:
+            continue
+        if isinstance(value, list) and len(value) > preview_size:
+            value = value[:preview_size]
+            truncated.append(key)
+        summary[key] = value
+    summary['truncated'] = truncated
+    summary['chunks'] = streams
+    return summary
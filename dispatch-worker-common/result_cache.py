@@ -0,0 +1,257 @@
+# result_cache.py - Commit-level deduplication of analysis results.
+# Used by every Python worker.
+#
+# A finished report is stored in the 'results' collection under a key derived
+# from (normalized repo URL, commit SHA, analyzer version). The cloner claims
+# the key before cloning: a finished result is copied straight into the new
+# job, a running one adds the job as a follower, and otherwise the job becomes
+# the leader that runs the pipeline. When the leader finishes or fails, every
+# follower gets the same outcome.
+#
+# Matched vulnerabilities depend on the advisory index as well as the commit.
+# The workers that hold the index publish its build time to ADVISORY_BUILD_DOC,
+# each result records the build it was scanned with, and a result from an older
+# build than the latest published one is treated as a miss, so an unchanged
+# commit is re-scanned (cheaply, from the blob cache) after the index is rebuilt.
+#
+# When a claim replaces an earlier run of the same key (a stale result, or an
+# abandoned one), that run's report chunks are entered in
+# EXPIRED_RUNS_COLLECTION, and the workers holding the report store delete
+# them once REPORT_RETENTION_DAYS have passed (see report_store.py). Jobs that
+# copied the old summary keep their per-file results until then.
+
+import hashlib
+import os
+import threading
+import time
+
+from firebase_admin import firestore
+
+RESULTS_COLLECTION = 'results'
+# Bump with scanner.ANALYZER_VERSION / complexity.ANALYZER_VERSION so old results stop matching.
+ANALYZER_VERSION = 'security-1+complexity-1'
+# A 'Running' claim older than this is assumed to belong to a crashed leader.
+# A leader that crashes before acking its submission does not wait this out:
+# the redelivered message carries the same job ID and takes the claim back.
+CLAIM_TIMEOUT_SECONDS = 2 * 60 * 60
+# (collection, document) holding the newest advisory index build any worker has seen.
+ADVISORY_BUILD_DOC = ('meta', 'advisoryIndex')
+# How long the published advisory build is cached between claims.
+ADVISORY_BUILD_TTL_SECONDS = 60
+
+# Report chunk runs due for deletion: {'owner', 'run', 'expiresAt'}, swept by report_store.
+EXPIRED_RUNS_COLLECTION = 'expiredReportRuns'
+# How long the per-file results of a superseded run (or of a job without a result key) are kept.
+REPORT_RETENTION_SECONDS = float(os.environ.get('REPORT_RETENTION_DAYS', '30')) * 24 * 60 * 60
+
+HIT = 'hit'
+LEADER = 'leader'
+FOLLOWER = 'follower'
+
+
+def result_key(normalized_repo_url, commit_sha, analyzer_version=ANALYZER_VERSION):
+    return hashlib.sha256(f"{normalized_repo_url}\n{commit_sha}\n{analyzer_version}".encode()).hexdigest()
+
+
+def expired_run_ref(db, owner, run):
+    """The ledger entry of one run's report chunks; one per (owner, run), so entering it twice is harmless."""
+    return db.collection(EXPIRED_RUNS_COLLECTION).document(hashlib.sha256(f"{owner}\n{run}".encode()).hexdigest()[:40])
+
+
+def expired_run(owner, run, delay=REPORT_RETENTION_SECONDS):
+    return {'owner': owner, 'run': run, 'expiresAt': time.time() + delay}
+
+
+class ResultCache:
+    """Claims, completes and fails shared pipeline runs in the 'results' collection."""
+
+    def __init__(self, db, job_writer):
+        self.db = db
+        self.job_writer = job_writer
+        self._lock = threading.Lock()
+        self._advisory_build = None
+        self._advisory_build_read_at = None
+        self._advisory_build_published = None
+
+    def _ref(self, key):
+        return self.db.collection(RESULTS_COLLECTION).document(key)
+
+    def _advisory_build_ref(self):
+        return self.db.collection(ADVISORY_BUILD_DOC[0]).document(ADVISORY_BUILD_DOC[1])
+
+    def advisory_build(self):
+        """The newest published advisory index build (epoch seconds), or None. Cached for a minute."""
+        with self._lock:
+            read_at = self._advisory_build_read_at
+            if read_at is not None and time.monotonic() - read_at < ADVISORY_BUILD_TTL_SECONDS:
+                return self._advisory_build
+        try:
+            snapshot = self._advisory_build_ref().get()
+            built_at = snapshot.to_dict().get('builtAt') if snapshot.exists else None
+        except Exception as e:
+            print(f" [!] Could not read the published advisory index build: {e}")
+            built_at = None
+        with self._lock:
+            self._advisory_build = built_at
+            self._advisory_build_read_at = time.monotonic()
+        return built_at
+
+    def publish_advisory_build(self, built_at):
+        """Records the advisory index build a worker scans with, if it is newer than the published one. Best effort."""
+        if built_at is None:
+            return
+        with self._lock:
+            if self._advisory_build_published is not None and built_at <= self._advisory_build_published:
+                return
+        ref = self._advisory_build_ref()
+
+        @firestore.transactional
+        def run(transaction):
+            snapshot = ref.get(transaction=transaction)
+            published = snapshot.to_dict().get('builtAt') if snapshot.exists else None
+            if published is None or built_at > published:
+                transaction.set(ref, {'builtAt': built_at, 'updatedAt': firestore.SERVER_TIMESTAMP})
+            return max(built_at, published or 0)
+
+        try:
+            newest = run(self.db.transaction())
+        except Exception as e:
+            print(f" [!] Could not publish advisory index build {built_at}: {e}")
+            return
+        with self._lock:
+            self._advisory_build_published = newest
+            self._advisory_build, self._advisory_build_read_at = newest, time.monotonic()
+
+    def watch_advisory_index(self, index, interval=ADVISORY_BUILD_TTL_SECONDS):
+        """Publishes the build of a worker's AdvisoryIndex now and whenever it is rebuilt, on a daemon thread."""
+
+        def watch():
+            while True:
+                try:
+                    self.publish_advisory_build(index.built_at() if index.available else None)
+                except Exception as e:
+                    print(f" [!] Could not read advisory index build: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=watch, name='advisory-build-watch', daemon=True).start()
+
+    def claim(self, key, job_id, job_data, repo_url, commit_sha):
+        """Registers job_id against key. Returns (HIT, report), (LEADER, None) or (FOLLOWER, None).
+
+        A follower's job document is written inside the same transaction, so it
+        always exists before the leader can fan its result out to it. A claim
+        job_id already leads (its submission was redelivered after a crash) is
+        taken over again with its followers. Taking over another job's run
+        (stale or abandoned) schedules that run's report chunks for deletion.
+        """
+        result_ref = self._ref(key)
+        job_ref = self.db.collection('jobs').document(job_id)
+        advisory_build = self.advisory_build()
+
+        @firestore.transactional
+        def run(transaction):
+            snapshot = result_ref.get(transaction=transaction)
+            data = snapshot.to_dict() if snapshot.exists else None
+            previous_run = (data or {}).get('leaderJobId')
+            now = time.time()
+            if data and data.get('status') == 'Complete':
+                if advisory_build is None or (data.get('advisoryIndexBuiltAt') or 0) >= advisory_build:
+                    return HIT, data.get('report')
+                # Scanned against an older advisory index: run it again and replace it.
+                data = None
+            if (data and data.get('status') == 'Running' and data.get('leaderJobId') != job_id
+                    and now - data.get('claimedAt', 0) < CLAIM_TIMEOUT_SECONDS):
+                transaction.update(result_ref, {'followers': firestore.ArrayUnion([job_id])})
+                transaction.set(job_ref, {
+                    **job_data,
+                    'status': 'Waiting for Shared Analysis',
+                    'sharedWithJobId': data.get('leaderJobId'),
+                })
+                return FOLLOWER, None
+            if previous_run and previous_run != job_id:
+                owner = f"{RESULTS_COLLECTION}/{key}"
+                transaction.set(expired_run_ref(self.db, owner, previous_run), expired_run(owner, previous_run))
+            transaction.set(result_ref, {
+                'status': 'Running',
+                'repoUrl': repo_url,
+                'commitSha': commit_sha,
+                'analyzerVersion': ANALYZER_VERSION,
+                'leaderJobId': job_id,
+                # Followers of an abandoned claim are inherited by the new leader.
+                'followers': (data or {}).get('followers', []),
+                'claimedAt': now,
+                'report': None,
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+            return LEADER, None
+
+        return run(self.db.transaction())
+
+    def _close(self, key, job_id, result_fields):
+        """Applies result_fields to job_id's claim (or deletes it if None) and returns its followers."""
+        result_ref = self._ref(key)
+
+        @firestore.transactional
+        def run(transaction):
+            snapshot = result_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return []
+            data = snapshot.to_dict()
+            if data.get('leaderJobId') != job_id:
+                # Our claim timed out and another job took over; leave it alone.
+                return []
+            if result_fields is None:
+                transaction.delete(result_ref)
+            else:
+                transaction.update(result_ref, {**result_fields, 'followers': []})
+            return data.get('followers', [])
+
+        return run(self.db.transaction())
+
+    def complete(self, key, job_id):
+        """Stores the leader job's finished report and copies it into every follower job.
+
+        Only the report summary is copied: its chunk manifests point at this
+        result's own reportChunks, so every copy reads the same per-file results
+        without reaching into the leader's job (see report_store.py).
+
+        Best effort: the leader's own job is already complete, so errors are only logged.
+        Followers stranded by a failure here are picked up when the claim times out.
+        """
+        try:
+            report = self.db.collection('jobs').document(job_id).get().get('report')
+            followers = self._close(key, job_id, {
+                'status': 'Complete',
+                'report': report,
+                'advisoryIndexBuiltAt': ((report or {}).get('security') or {}).get('advisoryIndexBuiltAt'),
+                'completedAt': time.time(),
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+        except Exception as e:
+            print(f" [!] Could not store shared result for job {job_id}: {e}")
+            return
+        for follower_id in followers:
+            self.job_writer.update(follower_id, {
+                'status': 'Complete',
+                'report': report,
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+        if followers:
+            self.job_writer.flush()
+            print(f" [->] Shared result of job {job_id} with {len(followers)} waiting job(s).")
+
+    def fail(self, key, job_id, error_details):
+        """Drops the claim so the next submission retries, and fails every follower job. Best effort."""
+        try:
+            followers = self._close(key, job_id, None)
+        except Exception as e:
+            print(f" [!] Could not release shared result claim for job {job_id}: {e}")
+            return
+        for follower_id in followers:
+            self.job_writer.update(follower_id, {
+                'status': 'Error',
+                'errorDetails': f"Shared analysis (job {job_id}) failed: {error_details}",
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+        if followers:
+            self.job_writer.flush()
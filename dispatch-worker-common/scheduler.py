@@ -0,0 +1,313 @@
+# scheduler.py - Size-aware, per-user fair scheduling of pipeline jobs.
+# Used by every Python worker.
+#
+# Jobs on repos up to SCHED_SMALL_REPO_MAX_MB run in the small lane and
+# everything else, including repos of unknown size, in the large lane. The
+# lanes exist at the broker: the entry stage admits each submission by
+# estimating its size before cloning it (see job_cost.py) and republishing it
+# to '<queue>.small' or '<queue>.large' with a schedule header, and every stage
+# hands a job on to the next stage's queue of the same lane. Each stage
+# consumes both lane queues with a prefetch window of its own, so a backlog of
+# monorepos only ever fills the large lane's queue and window, and small jobs
+# keep being delivered behind it. The entry stage passes the size it measured
+# downstream, so later stages never estimate again.
+#
+# Deliveries are then held here instead of being run in arrival order. The
+# WORKER_CONCURRENCY slots are split between the lanes, so monorepos can only
+# ever occupy the large ones; idle large slots help out with small jobs. With
+# a single slot there is nothing to split: it serves both lanes, taking turns
+# between them whenever both have work waiting. Within a lane, users take turns
+# by deficit round-robin weighted by repo size, and no user runs more than
+# SCHED_USER_MAX_RUNNING jobs at once while other users have work waiting.
+# With nobody else waiting the cap is lifted, so slots never sit idle.
+#
+# Fairness between users is per worker process and per lane window. Keep
+# SCHED_PREFETCH small enough that a held delivery starts well within
+# RabbitMQ's consumer_timeout.
+
+import copy
+import os
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pika
+
+from consumer import WORKER_CONCURRENCY, consume
+
+# --- Scheduling Configuration ---
+# Set to 0 to consume in plain arrival order.
+FAIR_SCHEDULING = os.environ.get('FAIR_SCHEDULING', '1') != '0'
+# Repos at or under this size (MiB) run in the small lane.
+SMALL_REPO_MAX_MB = float(os.environ.get('SCHED_SMALL_REPO_MAX_MB', '50'))
+# Slots reserved for large repos; the rest of WORKER_CONCURRENCY serves the small lane.
+# The lanes always add up to WORKER_CONCURRENCY; a lone slot is shared by both lanes.
+if WORKER_CONCURRENCY > 1:
+    LARGE_SLOTS = min(WORKER_CONCURRENCY - 1, int(os.environ.get('SCHED_LARGE_SLOTS', '0')) or max(1, WORKER_CONCURRENCY // 4))
+    SMALL_SLOTS = WORKER_CONCURRENCY - LARGE_SLOTS
+    SHARED_SLOTS = 0
+else:
+    LARGE_SLOTS = SMALL_SLOTS = 0
+    SHARED_SLOTS = 1
+# Most jobs one user may run at once while others wait. The default keeps one slot free for everyone else.
+USER_MAX_RUNNING = int(os.environ.get('SCHED_USER_MAX_RUNNING', '0')) or max(1, WORKER_CONCURRENCY - 1)
+# How many deliveries of each lane queue to hold for scheduling. Only jobs in the windows compete for slots.
+PREFETCH = int(os.environ.get('SCHED_PREFETCH', '0')) or 4 * max(1, WORKER_CONCURRENCY)
+# How many submissions the entry stage classifies at once while admitting them to a lane.
+ADMIT_PREFETCH = int(os.environ.get('SCHED_ADMIT_PREFETCH', '16'))
+ADMIT_THREADS = int(os.environ.get('SCHED_ADMIT_THREADS', '4'))
+
+LANES = ('small', 'large')
+# {'lane': ..., 'user': ..., 'cost': MiB}, set by the entry stage on every hand-off.
+SCHEDULE_HEADER = 'x-dispatch-schedule'
+_MB = 1024 * 1024
+
+
+def lane_queue(queue, lane):
+    return f"{queue}.{lane}"
+
+
+def lane_queues(queue):
+    """The lane queues of a stage queue."""
+    return [lane_queue(queue, lane) for lane in LANES]
+
+
+def stage_queues(queue):
+    """Everything a stage consumes: its lane queues, and the queue itself for hand-offs that carry no lane."""
+    return [queue] + lane_queues(queue)
+
+
+def declare_stage_queues(channel, queue):
+    for name in stage_queues(queue):
+        channel.queue_declare(queue=name, durable=True)
+
+
+def publish_queue(queue, headers):
+    """Where to hand a job on to: its lane's queue under fair scheduling, else the stage queue itself."""
+    schedule = headers.get(SCHEDULE_HEADER)
+    return lane_queue(queue, schedule['lane']) if FAIR_SCHEDULING and schedule else queue
+
+
+def lane_for(size_bytes, small_repo_max_mb=SMALL_REPO_MAX_MB):
+    """Returns (lane, cost in MiB) for a repo size in bytes, or for None if it is unknown."""
+    if size_bytes is None:
+        # Guessing small would let an unknown monorepo block the small lane.
+        return 'large', small_repo_max_mb
+    size_mb = size_bytes / _MB
+    return ('small' if size_mb <= small_repo_max_mb else 'large'), max(1.0, size_mb)
+
+
+def schedule_headers(user, size_bytes):
+    """AMQP headers telling the next stage how to schedule a job."""
+    lane, cost = lane_for(size_bytes)
+    return {SCHEDULE_HEADER: {'lane': lane, 'user': user, 'cost': cost}}
+
+
+def forwarded_schedule_headers(properties):
+    """The schedule header of a delivery, to pass on unchanged to the next stage."""
+    headers = getattr(properties, 'headers', None) or {}
+    return {SCHEDULE_HEADER: headers[SCHEDULE_HEADER]} if SCHEDULE_HEADER in headers else {}
+
+
+def header_classifier(properties, body):
+    """Classifies a hand-off between stages by its schedule header."""
+    schedule = (getattr(properties, 'headers', None) or {}).get(SCHEDULE_HEADER)
+    if not schedule:
+        lane, cost = lane_for(None)
+        return lane, '', cost
+    return schedule['lane'], schedule['user'], float(schedule['cost'])
+
+
+class Admission:
+    """Moves submissions from an entry queue into its lane queues at the broker.
+
+    classify(properties, body) -> (lane, user, cost) may wait on a size probe,
+    so it runs on a small pool of its own. The admitted message keeps its body
+    and headers, gains a schedule header, and is acked once it is republished.
+    """
+
+    def __init__(self, queue, classify, prefetch=ADMIT_PREFETCH, threads=ADMIT_THREADS):
+        self.queue = queue
+        self.prefetch = prefetch
+        self._classify = classify
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='admit')
+
+    def submit(self, ch, method, properties, body):
+        """Admits one delivery in the background; ch must be safe to use from other threads."""
+        self._pool.submit(self._admit, ch, method, properties, body)
+
+    def stop(self):
+        """Finishes the admissions in progress; unstarted deliveries return to the broker on disconnect."""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def _admit(self, ch, method, properties, body):
+        try:
+            lane, user, cost = self._classify(properties, body)
+        except Exception as e:
+            # The callback will report the broken job; just keep it out of the small lane.
+            print(f" [!] Could not estimate job cost, admitting it as large: {e}")
+            (lane, cost), user = lane_for(None), ''
+        admitted = copy.copy(properties) if properties is not None else pika.BasicProperties(delivery_mode=2)
+        admitted.headers = {**(admitted.headers or {}), SCHEDULE_HEADER: {'lane': lane, 'user': user, 'cost': cost}}
+        ch.basic_publish(exchange='', routing_key=lane_queue(self.queue, lane), body=body, properties=admitted)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def consume_stage(connection, channel, queue, callback, name, admit=None, stopping=None):
+    """Consumes a stage queue and its lanes, logging the worker's startup line.
+
+    admit(properties, body) -> (lane, user, cost) makes this the entry stage:
+    submissions to queue itself are admitted to a lane instead of run.
+    """
+    if not FAIR_SCHEDULING:
+        print(f' [*] {name} worker waiting for messages (concurrency {WORKER_CONCURRENCY}). To exit press CTRL+C')
+        # The lane queues are drained too, in case fair scheduling was just switched off.
+        consume(connection, channel, stage_queues(queue), callback, stopping=stopping)
+        return
+
+    scheduler = FairScheduler(header_classifier)
+    print(f" [*] {name} worker waiting for messages ({scheduler.describe()}, "
+          f"at most {scheduler.user_max_running} per user while others wait). To exit press CTRL+C")
+    if admit is None:
+        # Jobs keep the lane the entry stage put them in.
+        consume(connection, channel, stage_queues(queue), callback, prefetch=PREFETCH, scheduler=scheduler,
+                stopping=stopping)
+    else:
+        consume(connection, channel, lane_queues(queue), callback, prefetch=PREFETCH, scheduler=scheduler,
+                admission=Admission(queue, admit), stopping=stopping)
+
+
+class _UserQueue:
+    def __init__(self):
+        self.tasks = deque() # (cost, task)
+        self.deficit = 0.0
+
+
+class FairScheduler:
+    """Runs tasks on per-lane slots, deficit round-robin across users within a lane.
+
+    classify(properties, body) -> (lane, user, cost) runs on a small estimator
+    pool, so submit() never blocks; run(task) is called on the slot threads.
+    Shared slots serve both lanes in turn.
+    """
+
+    def __init__(self, classify, small_slots=SMALL_SLOTS, large_slots=LARGE_SLOTS, shared_slots=SHARED_SLOTS,
+                 user_max_running=USER_MAX_RUNNING, quantum=SMALL_REPO_MAX_MB):
+        self._run = None
+        self._classify = classify
+        self.slots = {'small': small_slots, 'large': large_slots, 'shared': shared_slots}
+        self.user_max_running = user_max_running
+        self.quantum = quantum
+        # Per lane: user -> _UserQueue, ordered so the first user is next in turn.
+        self._lanes = {lane: OrderedDict() for lane in LANES}
+        self._running = Counter() # user -> jobs running, across lanes
+        self._active = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._estimator = ThreadPoolExecutor(max_workers=2, thread_name_prefix='estimate')
+        self._threads = [threading.Thread(target=self._work, args=(kind,), name=f"{kind}-{i}", daemon=True)
+                         for kind, count in self.slots.items() for i in range(count)]
+
+    def describe(self):
+        """The slot layout, for the startup log line."""
+        lanes = [f"{self.slots[kind]} {kind}-lane" for kind in LANES if self.slots[kind]]
+        if self.slots['shared']:
+            lanes.append(f"{self.slots['shared']} shared")
+        return f"{' and '.join(lanes)} slot{'s' if sum(self.slots.values()) > 1 else ''}"
+
+    def start(self, run):
+        """Starts the slot threads, each calling run(task) for the tasks it picks."""
+        self._run = run
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, task, properties, body):
+        """Queues task once its delivery has been classified. Returns immediately."""
+        self._estimator.submit(self._admit, task, properties, body)
+
+    def busy(self):
+        """True while any task is running."""
+        with self._cond:
+            return self._active > 0
+
+    def waiting(self):
+        with self._cond:
+            return {lane: sum(len(q.tasks) for q in users.values()) for lane, users in self._lanes.items()}
+
+    def stop(self):
+        """Drops queued tasks and lets running ones finish; unstarted deliveries return to the broker on disconnect."""
+        with self._cond:
+            self._stopping = True
+            for users in self._lanes.values():
+                users.clear()
+            self._cond.notify_all()
+        self._estimator.shutdown(wait=False)
+
+    def _admit(self, task, properties, body):
+        try:
+            lane, user, cost = self._classify(properties, body)
+        except Exception as e:
+            # The callback will report the broken job; just keep it out of the small lane.
+            print(f" [!] Could not estimate job cost, scheduling it as large: {e}")
+            lane, user, cost = 'large', '', self.quantum
+        with self._cond:
+            if self._stopping:
+                return
+            self._lanes[lane].setdefault(user, _UserQueue()).tasks.append((cost, task))
+            self._cond.notify_all()
+
+    def _capped(self, user):
+        """True if user is at the cap and someone else has work waiting. Called with the lock held."""
+        if self._running[user] < self.user_max_running:
+            return False
+        return any(other != user for users in self._lanes.values() for other in users)
+
+    def _pick(self, lane):
+        """Pops the next task of a lane by deficit round-robin. Called with the lock held."""
+        users = self._lanes[lane]
+        if all(self._capped(user) for user in users):
+            return None
+        while True:
+            user, queue = next(iter(users.items()))
+            if not self._capped(user):
+                cost, task = queue.tasks[0]
+                if queue.deficit >= cost:
+                    queue.deficit -= cost
+                    queue.tasks.popleft()
+                    if not queue.tasks:
+                        del users[user] # Idle users don't bank credit.
+                    return user, task
+                queue.deficit += self.quantum
+            users.move_to_end(user)
+
+    def _work(self, kind):
+        # Small lane first; large slots fall back to it, shared slots alternate.
+        order = {'small': ('small',), 'large': ('large', 'small'), 'shared': ['small', 'large']}[kind]
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    picked = None
+                    for lane in order:
+                        picked = self._pick(lane)
+                        if picked:
+                            if kind == 'shared':
+                                # Let the other lane go first next time, so neither starves.
+                                order = [other for other in LANES if other != lane] + [lane]
+                            break
+                    if picked:
+                        break
+                    self._cond.wait()
+                user, task = picked
+                self._running[user] += 1
+                self._active += 1
+            try:
+                self._run(task)
+            finally:
+                with self._cond:
+                    self._running[user] -= 1
+                    if not self._running[user]:
+                        del self._running[user]
+                    self._active -= 1
+                    self._cond.notify_all()
@@ -0,0 +1,284 @@
+# telemetry.py - Per-stage job tracing and a Prometheus metrics endpoint.
+# Used by every Python worker.
+#
+# Each job carries a W3C trace context and a table of per-stage timestamps in
+# its AMQP headers, seeded by the API at submit time. Workers time the spans of
+# a callback (queue wait, state writes, clone, scan, publish) into histograms,
+# which are always on and cost a lock and a bisect per observation. Sampled
+# jobs additionally keep their individual spans, which are logged and served
+# at /traces.
+
+import bisect
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Telemetry Configuration ---
+# Port of the /metrics and /traces endpoint. 0 disables it.
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9100'))
+# Fraction of jobs whose individual spans are kept, for jobs that arrive
+# without a sampling decision. 0 turns span recording off entirely, even for
+# jobs the API sampled; histograms and counters are always recorded.
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '1.0'))
+# How many sampled job traces /traces keeps.
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', '200'))
+
+# --- AMQP Headers ---
+TRACEPARENT_HEADER = 'traceparent'
+# {'<stage>.<event>': epoch milliseconds}, e.g. 'api.submitted', 'cloner.published'.
+TIMINGS_HEADER = 'x-dispatch-timings'
+# When the message being consumed was published, in epoch milliseconds.
+PUBLISHED_AT_HEADER = 'x-dispatch-published-at'
+
+# Seconds. Covers a Firestore write at the low end and a large clone at the high end.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_METRICS = {
+    'dispatch_span_seconds': ('histogram', 'Time spent in each span of a job, by worker and span.'),
+    'dispatch_end_to_end_seconds': ('histogram', 'Time from API submission until a job reached a terminal state.'),
+    'dispatch_jobs_in_flight': ('gauge', 'Jobs currently inside a worker callback.'),
+    'dispatch_jobs_total': ('counter', 'Jobs a worker finished handling, by outcome.'),
+    'dispatch_job_errors_total': ('counter', 'Jobs that failed, by the span that raised.'),
+}
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def parse_traceparent(value):
+    """Returns (trace_id, parent_span_id, sampled) from a traceparent header, or None if malformed."""
+    if isinstance(value, bytes):
+        value = value.decode('ascii', errors='replace')
+    parts = value.split('-') if isinstance(value, str) else []
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Labelled histograms, gauges and counters, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {name: {} for name in _METRICS} # name -> {label tuple: value}
+
+    def observe(self, name, labels, seconds):
+        with self._lock:
+            series = self._series[name]
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = _Histogram()
+            histogram.observe(max(0.0, seconds))
+
+    def add(self, name, labels, amount=1):
+        with self._lock:
+            series = self._series[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def snapshot(self, name):
+        """Returns {labels: (count, sum)} for a histogram, or {labels: value} otherwise."""
+        with self._lock:
+            return {labels: (value.count, value.sum) if isinstance(value, _Histogram) else value
+                    for labels, value in self._series[name].items()}
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in _METRICS.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(self._series[name].items()):
+                    label_text = ','.join(f'{key}="{val}"' for key, val in labels)
+                    if kind != 'histogram':
+                        lines.append(f"{name}{{{label_text}}} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), value.buckets):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+                    lines.append(f"{name}_sum{{{label_text}}} {value.sum}")
+                    lines.append(f"{name}_count{{{label_text}}} {value.count}")
+        return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    """The spans of one job inside one worker callback. Not shared between jobs."""
+
+    def __init__(self, tracer, trace_id, parent_span_id, sampled, timings, published_at_ms):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.parent_span_id = parent_span_id
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.sampled = sampled
+        self.timings = timings
+        self.received_at = time.monotonic()
+        self.spans = [] # (name, start offset, duration) of sampled traces
+        self.outcome = None
+        self.failed_span = None
+        self._lock = threading.Lock()
+        self.timings[f"{tracer.worker}.received"] = _now_ms()
+        if published_at_ms is not None:
+            # Wall clocks of different hosts; a skewed clock can make this slightly negative.
+            wait = max(0.0, (self.timings[f"{tracer.worker}.received"] - published_at_ms) / 1000)
+            self.record('queue_wait', wait, start=-wait)
+
+    def record(self, name, seconds, start=None):
+        """Records a span that was timed elsewhere."""
+        self.tracer.metrics.observe('dispatch_span_seconds', (('worker', self.tracer.worker), ('span', name)), seconds)
+        if self.sampled:
+            offset = time.monotonic() - self.received_at - seconds if start is None else start
+            with self._lock:
+                self.spans.append((name, round(offset, 4), round(max(0.0, seconds), 4)))
+
+    @contextmanager
+    def span(self, name):
+        """Times the enclosed block as a span; an exception escaping it is charged to the span."""
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            if self.failed_span is None:
+                self.failed_span = name
+            raise
+        finally:
+            self.record(name, time.monotonic() - started)
+
+    def headers(self):
+        """AMQP headers for handing the job to the next stage: this span becomes the parent."""
+        now = _now_ms()
+        self.timings[f"{self.tracer.worker}.published"] = now
+        self.outcome = self.outcome or 'forwarded'
+        return {
+            TRACEPARENT_HEADER: f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}",
+            TIMINGS_HEADER: dict(self.timings),
+            PUBLISHED_AT_HEADER: now,
+        }
+
+    def complete(self):
+        """Marks the job as finished for good and records its end-to-end latency."""
+        self.outcome = 'complete'
+        submitted = self.timings.get('api.submitted')
+        if submitted is not None:
+            self.tracer.metrics.observe('dispatch_end_to_end_seconds', (('worker', self.tracer.worker),),
+                                        (_now_ms() - submitted) / 1000)
+
+    def skip(self, outcome):
+        """Marks the job as handled without doing the work, e.g. 'cached' or 'shared'."""
+        self.outcome = outcome
+
+    def error(self, exc):
+        self.outcome = 'error'
+        self.tracer.metrics.add('dispatch_job_errors_total',
+                                (('worker', self.tracer.worker), ('span', self.failed_span or 'callback')))
+
+    def finish(self):
+        """Closes the trace: call exactly once, from the callback's finally block."""
+        self.tracer.finish(self)
+
+
+class Tracer:
+    """Starts a Trace per delivered message and owns one worker's metrics."""
+
+    def __init__(self, worker, sample_rate=TRACE_SAMPLE_RATE):
+        self.worker = worker
+        self.sample_rate = sample_rate
+        self.metrics = Metrics()
+        self.recent = deque(maxlen=TRACE_BUFFER_SIZE)
+        self._server = None
+
+    def start(self, properties):
+        """Begins tracing a delivery, continuing the trace in its headers if there is one."""
+        headers = getattr(properties, 'headers', None) or {}
+        context = parse_traceparent(headers.get(TRACEPARENT_HEADER))
+        if context:
+            trace_id, parent_span_id, sampled = context
+            sampled = sampled and self.sample_rate > 0
+        else:
+            trace_id, parent_span_id = '%032x' % random.getrandbits(128), None
+            sampled = random.random() < self.sample_rate
+        timings = {}
+        for key, value in (headers.get(TIMINGS_HEADER) or {}).items():
+            try:
+                timings[key.decode() if isinstance(key, bytes) else key] = int(value)
+            except (TypeError, ValueError):
+                continue
+        published_at = headers.get(PUBLISHED_AT_HEADER)
+        self.metrics.add('dispatch_jobs_in_flight', (('worker', self.worker),))
+        return Trace(self, trace_id, parent_span_id, sampled, timings,
+                     int(published_at) if published_at is not None else None)
+
+    def observe(self, span, seconds):
+        """Records a span that belongs to no single job, e.g. a batched state commit."""
+        self.metrics.observe('dispatch_span_seconds', (('worker', self.worker), ('span', span)), seconds)
+
+    def finish(self, trace):
+        duration = time.monotonic() - trace.received_at
+        outcome = trace.outcome or 'acked'
+        self.metrics.observe('dispatch_span_seconds', (('worker', self.worker), ('span', 'callback')), duration)
+        self.metrics.add('dispatch_jobs_in_flight', (('worker', self.worker),), -1)
+        self.metrics.add('dispatch_jobs_total', (('worker', self.worker), ('outcome', outcome)))
+        if trace.sampled:
+            record = {
+                'traceId': trace.trace_id,
+                'spanId': trace.span_id,
+                'parentSpanId': trace.parent_span_id,
+                'worker': self.worker,
+                'outcome': outcome,
+                'durationSeconds': round(duration, 4),
+                'spans': [{'name': n, 'startSeconds': s, 'durationSeconds': d} for n, s, d in trace.spans],
+                'timings': trace.timings,
+            }
+            self.recent.append(record)
+            summary = ' '.join(f"{n}={d * 1000:.0f}ms" for n, _, d in trace.spans)
+            print(f" [t] trace {trace.trace_id} {self.worker} {outcome} in {duration * 1000:.0f}ms: {summary}")
+
+    def serve(self, port=METRICS_PORT):
+        """Serves /metrics (Prometheus text) and /traces (recent sampled traces) on a daemon thread."""
+        if not port or self._server:
+            return
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = tracer.metrics.render().encode(), 'text/plain; version=0.0.4'
+                elif self.path == '/traces':
+                    body, content_type = json.dumps(list(tracer.recent)).encode(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Scrapes would drown out the job log.
+
+        self._server = ThreadingHTTPServer(('', port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics-server', daemon=True).start()
+        print(f" [*] Metrics on :{port}/metrics, sampled traces on :{port}/traces")
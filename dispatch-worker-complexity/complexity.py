@@ -0,0 +1,336 @@
+# complexity.py - The code complexity analyzer used by the complexity worker.
+# Walks a checked-out tree, runs lizard on every supported source file across a
+# process pool, and folds the per-file results into one report.
+#
+# The pool is created once per worker process and shared by every job. Its
+# processes come from a forkserver (or are spawned where there is none) rather
+# than forked from the worker, whose Firestore client and job threads must not
+# be copied mid-operation. Each job keeps at most its share of the processes
+# busy, so concurrent jobs split the cores instead of queueing behind the
+# largest one.
+
+import heapq
+import math
+import multiprocessing
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import types
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import lizard
+from lizard_languages import get_reader_for
+
+from checkout_files import SkippedFile, TOO_LARGE, open_regular, regular_size
+from consumer import WORKER_CONCURRENCY
+
+# Bump whenever the shape or meaning of the results changes.
+ANALYZER_VERSION = 'complexity-1'
+
+# --- Analysis Limits ---
+# Files above this size are almost always generated or minified; skip them.
+MAX_FILE_BYTES = int(os.environ.get('COMPLEXITY_MAX_FILE_BYTES', str(512 * 1024)))
+# Wall-clock budget for a single file before it is abandoned.
+FILE_TIMEOUT_SECONDS = float(os.environ.get('COMPLEXITY_FILE_TIMEOUT_SECONDS', '10'))
+# How many of the most complex functions to surface in the report.
+HOTSPOT_COUNT = int(os.environ.get('COMPLEXITY_HOTSPOT_COUNT', '10'))
+# Files handed to a pool process per task; amortizes IPC for many small files.
+BATCH_SIZE = int(os.environ.get('COMPLEXITY_BATCH_SIZE', '32'))
+
+SKIP_DIRS = {'.git', 'node_modules', 'vendor', 'third_party', 'dist', 'build', '__pycache__', '.venv', 'venv'}
+
+_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+
+class FileTimeout(Exception):
+    pass
+
+
+def available_cpus():
+    """Returns the number of cores this container may actually use (affinity and cgroup quota)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+# --- Process Pool ---
+# Analyzer processes shared by every job; defaults to the cores this container may use.
+PROCESSES = int(os.environ.get('COMPLEXITY_PROCESSES', '0')) or available_cpus()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _ready():
+    # Long enough that a round of these keeps every process busy at once.
+    time.sleep(0.05)
+    return os.getpid()
+
+
+def start_pool(processes=PROCESSES):
+    """Returns the shared process pool, starting all of its processes on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        if context.get_start_method() == 'forkserver':
+            context.set_forkserver_preload([__name__])
+        # A new process re-runs the parent's main script unless __main__ has no file.
+        # The workers set up Firebase, caches and threads at import, which the
+        # analyzer processes must not repeat, so they are all started now from a
+        # bare __main__ and never replaced while the pool is healthy.
+        main_module = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            pool = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+            # The pool only adds a process when none is idle, so keep it busy until all have answered.
+            started = set()
+            while len(started) < processes:
+                started.update(future.result() for future in [pool.submit(_ready) for _ in range(processes)])
+        finally:
+            sys.modules['__main__'] = main_module
+        _pool = pool
+        return _pool
+
+
+def _discard_pool(pool):
+    """Forgets a broken pool so the next job starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def is_source_file(relpath):
+    """True if relpath is outside skipped directories and in a language lizard can parse."""
+    parts = relpath.replace(os.sep, '/').split('/')
+    return not any(part in SKIP_DIRS for part in parts[:-1]) and get_reader_for(parts[-1]) is not None
+
+
+def iter_source_files(root):
+    """Yields (relative path, size) for every regular file lizard knows how to parse.
+
+    Symlinks are left out, like the fused pipeline's manifest does: they can point outside the checkout.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for filename in filenames:
+            if get_reader_for(filename) is None:
+                continue
+            path = os.path.join(dirpath, filename)
+            size = regular_size(path)
+            if size is not None:
+                yield os.path.relpath(path, root), size
+
+
+def maintainability_index(source, nloc, cyclomatic):
+    """Normalized (0-100) maintainability index.
+
+    Halstead volume is approximated from the raw token stream: N * log2(n),
+    with N total tokens and n distinct tokens.
+    """
+    tokens = _TOKEN_RE.findall(source)
+    if not tokens or nloc == 0:
+        return 100.0
+    volume = len(tokens) * math.log2(max(2, len(set(tokens))))
+    mi = 171 - 5.2 * math.log(volume) - 0.23 * cyclomatic - 16.2 * math.log(nloc)
+    return round(max(0.0, min(100.0, mi * 100 / 171)), 1)
+
+
+def analyze_source(relpath, source):
+    """Analyzes one file's source text and returns its per-file result."""
+    info = lizard.analyze_file.analyze_source_code(relpath, source)
+    functions = [{
+        'name': fn.name,
+        'line': fn.start_line,
+        'cyclomatic': fn.cyclomatic_complexity,
+        'nloc': fn.nloc,
+    } for fn in info.function_list]
+    total_cyclomatic = sum(fn['cyclomatic'] for fn in functions) or 1
+    return {
+        'path': relpath,
+        'loc': source.count('\n') + (0 if source.endswith('\n') or not source else 1),
+        'nloc': info.nloc,
+        'functions': functions,
+        'cyclomatic': max((fn['cyclomatic'] for fn in functions), default=1),
+        'maintainability': maintainability_index(source, info.nloc, total_cyclomatic),
+    }
+
+
+def _on_timeout(signum, frame):
+    raise FileTimeout()
+
+
+def _analyze_batch(root, relpaths, timeout, max_bytes=MAX_FILE_BYTES):
+    """Runs inside a pool process. Each file gets its own SIGALRM-based deadline.
+
+    Files are re-checked when opened, so a path that is not a regular file under
+    max_bytes by then is skipped instead of read.
+    """
+    signal.signal(signal.SIGALRM, _on_timeout)
+    results = []
+    for relpath in relpaths:
+        try:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+            with open_regular(os.path.join(root, relpath), max_bytes) as (f, _):
+                source = f.read(max_bytes).decode('utf-8', errors='replace')
+            results.append(analyze_source(relpath, source))
+        except SkippedFile as e:
+            results.append({'path': relpath, 'skipped': str(e)})
+        except FileTimeout:
+            results.append({'path': relpath, 'skipped': 'timeout'})
+        except Exception as e:
+            results.append({'path': relpath, 'skipped': f"error: {e}"})
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return results
+
+
+class ComplexityReport:
+    """Folds per-file results into the aggregated 'report.complexity' structure as they arrive."""
+
+    def __init__(self, hotspot_count=HOTSPOT_COUNT):
+        self.hotspot_count = hotspot_count
+        self.files = []
+        self.skipped = []
+        self._hotspots = [] # min-heap of (cyclomatic, tiebreak, hotspot)
+        self._function_count = 0
+        self._cyclomatic_total = 0
+        self._loc = 0
+        self._nloc = 0
+
+    def add(self, result):
+        if 'skipped' in result:
+            self.skipped.append(result)
+            return
+        self.files.append(result)
+        self._loc += result['loc']
+        self._nloc += result['nloc']
+        for fn in result['functions']:
+            self._function_count += 1
+            self._cyclomatic_total += fn['cyclomatic']
+            entry = (fn['cyclomatic'], self._function_count, {'path': result['path'], **fn})
+            if len(self._hotspots) < self.hotspot_count:
+                heapq.heappush(self._hotspots, entry)
+            elif entry[0] > self._hotspots[0][0]:
+                heapq.heapreplace(self._hotspots, entry)
+
+    def to_dict(self):
+        files = sorted(self.files, key=lambda r: r['path'])
+        average_mi = sum(f['maintainability'] for f in files) / len(files) if files else 100.0
+        average_cc = self._cyclomatic_total / self._function_count if self._function_count else 0.0
+        return {
+            'analyzerVersion': ANALYZER_VERSION,
+            'cyclomatic': round(average_cc, 2),
+            'maintainability': round(average_mi, 1),
+            'loc': self._loc,
+            'nloc': self._nloc,
+            'filesAnalyzed': len(files),
+            'functions': self._function_count,
+            'hotspots': [h for _, _, h in sorted(self._hotspots, key=lambda e: (-e[0], e[1]))],
+            'files': [{
+                'path': f['path'],
+                'loc': f['loc'],
+                'nloc': f['nloc'],
+                'functions': len(f['functions']),
+                'cyclomatic': f['cyclomatic'],
+                'maintainability': f['maintainability'],
+            } for f in files],
+            'skipped': sorted(self.skipped, key=lambda r: r['path']),
+        }
+
+
+def analyze_tree(root, files=None, workers=None, on_result=None, blob_shas=None, cache=None):
+    """Analyzes every supported file under root and returns the aggregated report dict.
+
+    files is an optional iterable of (relative path, size); by default the tree is walked.
+    on_result, if given, is called with each per-file result as soon as it is ready.
+    With blob_shas ({path: blob SHA}) and a BlobCache, files whose blob was analyzed
+    before are served from the cache and only new blobs go to the pool.
+    workers caps how many of this job's batches the shared pool runs at once
+    (by default, its share of the pool).
+    """
+    report = ComplexityReport()
+
+    def accept(result):
+        report.add(result)
+        if on_result:
+            on_result(result)
+
+    candidates = []
+    for relpath, size in (files if files is not None else iter_source_files(root)):
+        if size > MAX_FILE_BYTES:
+            accept({'path': relpath, 'skipped': TOO_LARGE})
+        else:
+            candidates.append(relpath)
+
+    # lizard picks the language from the extension, so it is part of the cache key.
+    cache_keys = {}
+    if cache is not None and blob_shas:
+        cache_keys = {relpath: (blob_shas[relpath], os.path.splitext(relpath)[1])
+                      for relpath in candidates if relpath in blob_shas}
+    cached = cache.get_many('complexity', ANALYZER_VERSION, set(cache_keys.values())) if cache_keys else {}
+
+    from_cache = 0
+    batch = []
+    batches = []
+    for relpath in candidates:
+        key = cache_keys.get(relpath)
+        if key in cached:
+            from_cache += 1
+            accept({**cached[key], 'path': relpath})
+            continue
+        batch.append(relpath)
+        if len(batch) >= BATCH_SIZE:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+
+    fresh = {}
+    if batches:
+        pool = start_pool()
+        # This job's share of the pool; the other job slots get theirs.
+        limit = workers or max(1, PROCESSES // WORKER_CONCURRENCY)
+        pending = set()
+        try:
+            while batches or pending:
+                while batches and len(pending) < limit:
+                    pending.add(pool.submit(_analyze_batch, root, batches.pop(0), FILE_TIMEOUT_SECONDS, MAX_FILE_BYTES))
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for result in future.result():
+                        accept(result)
+                        key = cache_keys.get(result['path'])
+                        # Timeouts and errors may be transient, so only real results are kept.
+                        if key and 'skipped' not in result:
+                            fresh[key] = {k: v for k, v in result.items() if k != 'path'}
+        except BrokenProcessPool:
+            # A pool process died (e.g. the OOM killer); fail this job, not every later one.
+            _discard_pool(pool)
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+    if fresh:
+        cache.put_many('complexity', ANALYZER_VERSION, fresh)
+
+    complexity_report = report.to_dict()
+    complexity_report['filesFromCache'] = from_cache
+    return complexity_report
@@ -0,0 +1,67 @@
+# file_manifest.py - One walk of a checkout, shared by every analyzer in the fused pipeline.
+# The file list comes from the git index (so blob SHAs come for free). Contents
+# are memory-mapped only while a reader holds them: a mapping keeps a file
+# descriptor open, so caching one per tracked file would run a large checkout
+# out of descriptors.
+
+import mmap
+import os
+import subprocess
+from collections import namedtuple
+from contextlib import contextmanager
+
+from checkout_files import open_regular
+
+FileEntry = namedtuple('FileEntry', ['path', 'size', 'blob_sha'])
+
+# Index modes that are not regular files: symlinks and submodules.
+_SKIPPED_MODES = {'120000', '160000'}
+
+
+class FileManifest:
+    """Immutable list of the tracked files in a checkout, with read-only access to their contents."""
+
+    def __init__(self, root, entries):
+        self.root = root
+        self.entries = tuple(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def files(self, predicate=None):
+        """Returns (path, size) pairs, the shape the analyzers accept, optionally filtered by path."""
+        return [(e.path, e.size) for e in self.entries if predicate is None or predicate(e.path)]
+
+    @contextmanager
+    def data(self, path, max_bytes):
+        """Yields the file's contents as a read-only mmap (b'' for empty files), unmapped on exit.
+
+        Raises checkout_files.SkippedFile if the path is no longer a regular file under max_bytes.
+        """
+        with open_regular(os.path.join(self.root, path), max_bytes) as (f, size):
+            if size == 0:
+                yield b''
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield data
+
+
+def build_manifest(root):
+    """Lists the checkout's tracked regular files with their sizes and blob SHAs."""
+    output = subprocess.run(['git', 'ls-files', '--stage', '-z'], cwd=root, check=True,
+                            stdout=subprocess.PIPE).stdout
+    entries = []
+    for record in output.split(b'\0'):
+        if not record:
+            continue
+        info, path = record.split(b'\t', 1)
+        mode, blob_sha, _ = info.decode().split(' ')
+        if mode in _SKIPPED_MODES:
+            continue
+        path = path.decode('utf-8', errors='surrogateescape')
+        try:
+            size = os.lstat(os.path.join(root, path)).st_size
+        except OSError:
+            continue # Tracked but missing from the working tree (e.g. sparse checkout).
+        entries.append(FileEntry(path, size, blob_sha))
+    return FileManifest(root, entries)
@@ -0,0 +1,235 @@
+# advisories.py - Offline vulnerability advisory index for the security worker.
+# OSV-format advisory feeds are compiled ahead of time into an indexed sqlite
+# file, so a lookup is one indexed query instead of loading the feed into RAM.
+#
+# Build an index from OSV exports (.zip, .json, or directories of .json):
+#   python advisories.py build advisories.db PyPI-all.zip npm-all.zip
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+
+ADVISORY_DB_PATH = os.environ.get('ADVISORY_DB_PATH', 'advisories.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS advisories (
+    id TEXT PRIMARY KEY,
+    aliases TEXT,
+    severity TEXT,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS affected (
+    advisory_id TEXT,
+    ecosystem TEXT,
+    package TEXT,
+    introduced TEXT,
+    fixed TEXT,
+    last_affected TEXT,
+    version TEXT
+);
+CREATE INDEX IF NOT EXISTS affected_package ON affected (ecosystem, package);
+"""
+
+_SEVERITY_NAMES = {
+    'CRITICAL': 'Critical',
+    'HIGH': 'High',
+    'MODERATE': 'Medium',
+    'MEDIUM': 'Medium',
+    'LOW': 'Low',
+}
+
+
+def normalize_package(ecosystem, name):
+    """Canonical package name for an ecosystem (PyPI names are case- and separator-insensitive)."""
+    if ecosystem == 'PyPI':
+        return re.sub(r'[-_.]+', '-', name).lower()
+    return name
+
+
+def version_key(version):
+    """Sort key that orders dotted versions numerically and pre-releases before releases."""
+    version = version.strip().lstrip('vV').split('+', 1)[0]
+    key = []
+    for part in re.findall(r'\d+|[A-Za-z]+', version):
+        if part.isdigit():
+            key.append((1, int(part), ''))
+        elif part.lower() in ('post', 'p', 'patch'):
+            key.append((2, 0, part.lower()))
+        else:
+            key.append((0, 0, part.lower()))
+    # Trailing zeros do not change a version: 1.0 == 1.0.0
+    while key and key[-1] == (1, 0, ''):
+        key.pop()
+    return key
+
+
+def _compare(a, b):
+    ka, kb = version_key(a), version_key(b)
+    length = max(len(ka), len(kb))
+    ka += [(1, 0, '')] * (length - len(ka))
+    kb += [(1, 0, '')] * (length - len(kb))
+    return (ka > kb) - (ka < kb)
+
+
+def _severity(record):
+    specific = (record.get('database_specific') or {}).get('severity')
+    if specific:
+        return _SEVERITY_NAMES.get(str(specific).upper(), str(specific).title())
+    return 'Unknown'
+
+
+def _affected_rows(record):
+    """Flattens one OSV record into (ecosystem, package, introduced, fixed, last_affected, version) rows."""
+    for affected in record.get('affected', []):
+        package = affected.get('package') or {}
+        ecosystem = (package.get('ecosystem') or '').split(':', 1)[0]
+        name = package.get('name')
+        if not ecosystem or not name:
+            continue
+        name = normalize_package(ecosystem, name)
+
+        for version in affected.get('versions', []):
+            yield ecosystem, name, None, None, None, version
+
+        for version_range in affected.get('ranges', []):
+            if version_range.get('type') not in ('SEMVER', 'ECOSYSTEM'):
+                continue # GIT ranges are commit hashes, not package versions.
+            introduced = None
+            for event in version_range.get('events', []):
+                if 'introduced' in event:
+                    introduced = event['introduced']
+                elif 'fixed' in event and introduced is not None:
+                    yield ecosystem, name, introduced, event['fixed'], None, None
+                    introduced = None
+                elif 'last_affected' in event and introduced is not None:
+                    yield ecosystem, name, introduced, None, event['last_affected'], None
+                    introduced = None
+            if introduced is not None:
+                yield ecosystem, name, introduced, None, None, None
+
+
+def _iter_feed(path):
+    """Yields OSV records from a .zip export, a .json file, or a directory of .json files."""
+    if os.path.isdir(path):
+        for dirpath, _, filenames in os.walk(path):
+            for filename in sorted(filenames):
+                if filename.endswith('.json'):
+                    yield from _iter_feed(os.path.join(dirpath, filename))
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.endswith('.json'):
+                    yield json.loads(archive.read(name))
+    else:
+        with open(path) as f:
+            data = json.load(f)
+        yield from (data if isinstance(data, list) else [data])
+
+
+def build_index(db_path, feed_paths):
+    """Compiles OSV feeds into a fresh sqlite index at db_path. Returns the advisory count."""
+    partial_path = f"{db_path}.partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    conn = sqlite3.connect(partial_path)
+    conn.executescript(SCHEMA)
+    count = 0
+    with conn:
+        for feed_path in feed_paths:
+            for record in _iter_feed(feed_path):
+                if record.get('withdrawn'):
+                    continue
+                conn.execute(
+                    'INSERT OR REPLACE INTO advisories VALUES (?, ?, ?, ?)',
+                    (record['id'], ','.join(record.get('aliases', [])), _severity(record),
+                     record.get('summary', '')[:500]))
+                conn.executemany(
+                    'INSERT INTO affected VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(record['id'],) + row for row in _affected_rows(record)])
+                count += 1
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('builtAt', ?)", (str(int(time.time())),))
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('advisories', ?)", (str(count),))
+    conn.execute('VACUUM')
+    conn.close()
+    # Readers never see a half-built index.
+    os.replace(partial_path, db_path)
+    return count
+
+
+class AdvisoryIndex:
+    """Read-only handle on a compiled advisory index. Safe to share between threads."""
+
+    def __init__(self, db_path=ADVISORY_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    @property
+    def available(self):
+        return os.path.exists(self.db_path)
+
+    def _conn(self):
+        # A rebuild replaces the file, and an open connection would keep reading
+        # the old one; reopen when the file changes, checked at most once a second.
+        now = time.monotonic()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and now - self._local.checked_at < 1:
+            return conn
+        self._local.checked_at = now
+        try:
+            stat = os.stat(self.db_path)
+            identity = (stat.st_ino, stat.st_mtime_ns)
+        except OSError:
+            identity = None
+        if conn is None or identity != self._local.identity:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True)
+            self._local.conn = conn
+            self._local.identity = identity
+        return conn
+
+    def built_at(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'builtAt'").fetchone()
+        return int(row[0]) if row else None
+
+    def lookup(self, ecosystem, package, version):
+        """Returns the advisories affecting one exact package version."""
+        rows = self._conn().execute(
+            'SELECT a.id, a.aliases, a.severity, a.summary, f.introduced, f.fixed, f.last_affected, f.version '
+            'FROM affected f JOIN advisories a ON a.id = f.advisory_id '
+            'WHERE f.ecosystem = ? AND f.package = ?',
+            (ecosystem, normalize_package(ecosystem, package))).fetchall()
+
+        matches = {}
+        for advisory_id, aliases, severity, summary, introduced, fixed, last_affected, exact in rows:
+            if advisory_id in matches:
+                continue
+            if exact is not None:
+                hit = _compare(version, exact) == 0
+            else:
+                hit = (introduced in (None, '0') or _compare(version, introduced) >= 0) \
+                    and (fixed is None or _compare(version, fixed) < 0) \
+                    and (last_affected is None or _compare(version, last_affected) <= 0)
+            if hit:
+                matches[advisory_id] = {
+                    'id': advisory_id,
+                    'aliases': [a for a in aliases.split(',') if a],
+                    'severity': severity,
+                    'summary': summary,
+                    'fixed': fixed,
+                }
+        return list(matches.values())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] != 'build':
+        print('Usage: python advisories.py build <db_path> <feed> [<feed> ...]')
+        sys.exit(2)
+    total = build_index(sys.argv[2], sys.argv[3:])
+    print(f" [✓] Indexed {total} advisories into {sys.argv[2]}")
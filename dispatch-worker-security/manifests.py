@@ -0,0 +1,125 @@
+# manifests.py - Dependency manifest and lockfile parsers for the security worker.
+# Each parser takes the file's text and returns (ecosystem, package, version)
+# tuples for exactly pinned dependencies; ranges cannot be matched reliably.
+# Manifests are user content: a parser skips entries of the wrong JSON type
+# instead of failing, and only raises ValueError for text that does not parse.
+
+import json
+import re
+
+_PINNED_REQUIREMENT = re.compile(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*===?\s*([^\s;#,]+)')
+_TOML_PACKAGE = re.compile(r'^\[\[package\]\]\s*\nname\s*=\s*"([^"]+)"\s*\nversion\s*=\s*"([^"]+)"', re.MULTILINE)
+_YARN_ENTRY = re.compile(r'^"?((?:@[^@/\s"]+/)?[^@\s"]+)@[^\n]*:\n(?:[ \t]+[^\n]*\n)*?[ \t]+version:?\s+"?([^"\s]+)"?', re.MULTILINE)
+_EXACT_VERSION = re.compile(r'^\d+(\.\d+)*([-.][0-9A-Za-z.]+)?$')
+
+
+def _object(value):
+    """value if it is a JSON object, else an empty one."""
+    return value if isinstance(value, dict) else {}
+
+
+def _load_json(text):
+    try:
+        return json.loads(text)
+    except RecursionError:
+        raise ValueError('JSON nested too deeply') from None
+
+
+def parse_requirements(text):
+    deps = []
+    for line in text.splitlines():
+        match = _PINNED_REQUIREMENT.match(line)
+        if match:
+            deps.append(('PyPI', match.group(1), match.group(2)))
+    return deps
+
+
+def parse_pipfile_lock(text):
+    data = _object(_load_json(text))
+    deps = []
+    for section in ('default', 'develop'):
+        for name, info in _object(data.get(section)).items():
+            version = _object(info).get('version')
+            version = version.lstrip('=') if isinstance(version, str) else ''
+            if version:
+                deps.append(('PyPI', name, version))
+    return deps
+
+
+def parse_poetry_lock(text):
+    return [('PyPI', name, version) for name, version in _TOML_PACKAGE.findall(text)]
+
+
+def parse_cargo_lock(text):
+    return [('crates.io', name, version) for name, version in _TOML_PACKAGE.findall(text)]
+
+
+def parse_package_lock(text):
+    data = _object(_load_json(text))
+    deps = []
+    # lockfileVersion 2/3: flat map keyed by install path.
+    for path, info in _object(data.get('packages')).items():
+        info = _object(info)
+        if not path or not isinstance(info.get('version'), str) or info.get('link'):
+            continue
+        name = info.get('name')
+        if not isinstance(name, str) or not name:
+            name = path.rsplit('node_modules/', 1)[-1]
+        deps.append(('npm', name, info['version']))
+    if deps:
+        return deps
+
+    # lockfileVersion 1: nested 'dependencies' tree.
+    stack = [_object(data.get('dependencies'))]
+    while stack:
+        for name, info in stack.pop().items():
+            info = _object(info)
+            if isinstance(info.get('version'), str):
+                deps.append(('npm', name, info['version']))
+            if info.get('dependencies'):
+                stack.append(_object(info['dependencies']))
+    return deps
+
+
+def parse_yarn_lock(text):
+    return [('npm', name, version) for name, version in _YARN_ENTRY.findall(text)]
+
+
+def parse_package_json(text):
+    data = _object(_load_json(text))
+    deps = []
+    for section in ('dependencies', 'devDependencies', 'optionalDependencies'):
+        for name, version in _object(data.get(section)).items():
+            if isinstance(version, str) and _EXACT_VERSION.match(version):
+                deps.append(('npm', name, version))
+    return deps
+
+
+def parse_go_sum(text):
+    deps = set()
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 2:
+            deps.add(('Go', parts[0], parts[1].split('/', 1)[0]))
+    return sorted(deps)
+
+
+_PARSERS = {
+    'Pipfile.lock': parse_pipfile_lock,
+    'poetry.lock': parse_poetry_lock,
+    'Cargo.lock': parse_cargo_lock,
+    'package-lock.json': parse_package_lock,
+    'npm-shrinkwrap.json': parse_package_lock,
+    'yarn.lock': parse_yarn_lock,
+    'package.json': parse_package_json,
+    'go.sum': parse_go_sum,
+}
+
+
+def parser_for(filename):
+    """Returns the parser for a manifest filename, or None if it is not a manifest."""
+    if filename in _PARSERS:
+        return _PARSERS[filename]
+    if filename.startswith('requirements') and filename.endswith('.txt'):
+        return parse_requirements
+    return None
@@ -0,0 +1,263 @@
+# scanner.py - The security scanner used by the security worker.
+# Every file is read exactly once: one Aho-Corasick pass over the rules' literal
+# anchors, with each rule's pattern run only where its anchors occur, plus
+# manifest parsing for dependency files. Dependencies are then
+# matched against the offline advisory index (see advisories.py).
+
+import mmap
+import os
+import re
+
+import ahocorasick
+
+from checkout_files import SkippedFile, TOO_LARGE, open_regular, regular_size
+from manifests import parser_for
+
+# Bump whenever the shape or meaning of the results changes.
+ANALYZER_VERSION = 'security-1'
+
+# --- Scan Limits ---
+MAX_FILE_BYTES = int(os.environ.get('SECURITY_MAX_FILE_BYTES', str(5 * 1024 * 1024)))
+
+SKIP_DIRS = {'.git', 'node_modules', 'vendor', 'third_party', 'bower_components', '__pycache__', '.venv', 'venv'}
+SKIP_SUFFIXES = ('.min.js', '.min.css', '.map', '.png', '.jpg', '.jpeg', '.gif', '.ico', '.pdf',
+                 '.zip', '.gz', '.tar', '.jar', '.woff', '.woff2', '.ttf', '.so', '.dll', '.exe')
+
+# --- Secret Rules ---
+# (name, anchors, pattern). Every match of a pattern must begin with one of its
+# anchors, compared case-insensitively; the anchors are what the prefilter
+# looks for, and a pattern only runs where one of them was found.
+SECRET_RULES = [
+    ('aws-access-key-id', ('AKIA', 'ASIA'), rb'\b(?:AKIA|ASIA)[0-9A-Z]{16}\b'),
+    ('github-token', ('ghp_', 'gho_', 'ghu_', 'ghs_', 'ghr_'), rb'\bgh[pousr]_[A-Za-z0-9]{36,255}\b'),
+    ('github-fine-grained-token', ('github_pat_',), rb'\bgithub_pat_[A-Za-z0-9_]{82}\b'),
+    ('slack-token', ('xoxa-', 'xoxb-', 'xoxp-', 'xoxo-', 'xoxs-', 'xoxr-'), rb'\bxox[abposr]-[A-Za-z0-9-]{10,72}'),
+    ('google-api-key', ('AIza',), rb'\bAIza[0-9A-Za-z_\-]{35}\b'),
+    ('stripe-live-key', ('rk_live_', 'sk_live_'), rb'\b[rs]k_live_[0-9A-Za-z]{24,99}\b'),
+    ('private-key', ('-----BEGIN ',),
+     rb'-----BEGIN (?:RSA |EC |DSA |OPENSSH |PGP |ENCRYPTED )?PRIVATE KEY(?: BLOCK)?-----'),
+    ('gcp-service-account', ('"private_key_id"',), rb'"private_key_id"\s*:\s*"[0-9a-f]{40}"'),
+    ('generic-credential',
+     ('password', 'passwd', 'secret', 'apikey', 'api_key', 'api-key', 'accesstoken', 'access_token',
+      'access-token', 'authtoken', 'auth_token', 'auth-token'),
+     rb'(?i:(?:password|passwd|secret|api[_-]?key|access[_-]?token|auth[_-]?token))["\']?\s*[:=]\s*["\'][^"\'\s]{8,}["\']'),
+]
+
+_RULE_PATTERNS = [(name, re.compile(pattern)) for name, _, pattern in SECRET_RULES]
+
+
+def _build_prefilter():
+    """One Aho-Corasick automaton over every rule's anchors: lowercased anchor -> rule indices."""
+    rules_by_anchor = {}
+    for index, (_, anchors, _) in enumerate(SECRET_RULES):
+        for anchor in anchors:
+            rules_by_anchor.setdefault(anchor.lower(), []).append(index)
+    automaton = ahocorasick.Automaton()
+    for anchor, indices in rules_by_anchor.items():
+        automaton.add_word(anchor, (len(anchor), tuple(indices)))
+    automaton.make_automaton()
+    return automaton
+
+
+_PREFILTER = _build_prefilter()
+
+
+def should_skip(relpath):
+    parts = relpath.replace(os.sep, '/').split('/')
+    return any(part in SKIP_DIRS for part in parts[:-1]) or parts[-1].endswith(SKIP_SUFFIXES)
+
+
+def is_binary(data):
+    return b'\0' in data[:8192]
+
+
+def iter_scan_files(root):
+    """Yields (relative path, size) for every regular file worth scanning; symlinks are left out."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(path, root)
+            if should_skip(relpath):
+                continue
+            size = regular_size(path)
+            if size is not None:
+                yield relpath, size
+
+
+def scan_secrets(data):
+    """Returns [{'rule', 'line'}] for every secret in data, in one pass over the bytes.
+
+    The prefilter walks the (lowercased) bytes once, whatever the number of
+    rules; each rule's pattern is then only tried where one of its anchors
+    starts. Candidates are taken left to right, lowest rule first on a tie,
+    and may not overlap an accepted match, like one alternation of all rules.
+    """
+    # latin-1 maps each byte to one character, so offsets carry over unchanged.
+    text = bytes(data).lower().decode('latin-1')
+    candidates = sorted({(end - length + 1, index)
+                         for end, (length, indices) in _PREFILTER.iter(text) for index in indices})
+    findings = []
+    line = 1
+    last = 0
+    matched_until = 0
+    for start, index in candidates:
+        if start < matched_until:
+            continue
+        name, pattern = _RULE_PATTERNS[index]
+        match = pattern.match(data, start)
+        if match is None:
+            continue
+        matched_until = match.end()
+        line += data[last:start].count(b'\n')
+        last = start
+        findings.append({'rule': name, 'line': line})
+    return findings
+
+
+def scan_data(relpath, data):
+    """Scans one file's contents. Returns {'path', 'secrets', 'dependencies'} or None for binaries."""
+    if is_binary(data):
+        return None
+    dependencies = []
+    parser = parser_for(os.path.basename(relpath))
+    if parser:
+        try:
+            dependencies = [list(dep) for dep in parser(bytes(data).decode('utf-8', errors='replace'))]
+        except (ValueError, AttributeError, TypeError) as e:
+            # One malformed manifest (a test fixture, say) must not fail the whole scan.
+            print(f" [!] Could not parse manifest {relpath}: {e}")
+    return {'path': relpath, 'secrets': scan_secrets(data), 'dependencies': dependencies}
+
+
+def scan_file(root, relpath, max_bytes=MAX_FILE_BYTES):
+    """Scans one file of the checkout. Raises SkippedFile if it is not a regular file under max_bytes."""
+    with open_regular(os.path.join(root, relpath), max_bytes) as (f, size):
+        if size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return scan_data(relpath, data)
+
+
+class SecurityReport:
+    """Collects per-file scan results and builds the 'report.security' structure."""
+
+    def __init__(self):
+        self.files_scanned = 0
+        self.bytes_scanned = 0
+        self.skipped = []
+        self.secrets = []
+        self.dependencies = {} # (ecosystem, package, version) -> first manifest path
+
+    def add(self, result, size=0):
+        if result is None:
+            return
+        if 'skipped' in result:
+            self.skipped.append(result)
+            return
+        self.files_scanned += 1
+        self.bytes_scanned += size
+        for finding in result['secrets']:
+            self.secrets.append({'path': result['path'], **finding})
+        for ecosystem, package, version in result['dependencies']:
+            self.dependencies.setdefault((ecosystem, package, version), result['path'])
+
+    def to_dict(self, index):
+        vulnerabilities = []
+        if index.available:
+            for (ecosystem, package, version), manifest in sorted(self.dependencies.items()):
+                for advisory in index.lookup(ecosystem, package, version):
+                    vulnerabilities.append({
+                        **advisory,
+                        'package': package,
+                        'version': version,
+                        'ecosystem': ecosystem,
+                        'manifest': manifest,
+                    })
+        else:
+            print(f" [!] Advisory index {index.db_path} not found; skipping dependency matching.")
+        return {
+            'analyzerVersion': ANALYZER_VERSION,
+            'vulnerabilitiesFound': len(vulnerabilities),
+            'details': vulnerabilities,
+            'secretsFound': len(self.secrets),
+            'secrets': sorted(self.secrets, key=lambda s: (s['path'], s['line'])),
+            'dependencies': len(self.dependencies),
+            'filesScanned': self.files_scanned,
+            'bytesScanned': self.bytes_scanned,
+            'skipped': sorted(self.skipped, key=lambda s: s['path']),
+            'advisoryIndexBuiltAt': index.built_at() if index.available else None,
+        }
+
+
+def file_findings(result):
+    """The secrets of one per-file result, shaped like the entries of report.security.secrets."""
+    return [{'path': result['path'], **finding} for finding in result.get('secrets', ())]
+
+
+def scan_tree(root, index, files=None, data_for=None, blob_shas=None, cache=None, on_result=None):
+    """Scans every file under root and returns the 'report.security' dict.
+
+    files is an optional iterable of (relative path, size); by default the tree is walked.
+    data_for, if given, is a context manager factory: data_for(relative path, max bytes)
+    yields the file's contents instead of them being read here, and releases them on exit.
+    It raises SkippedFile, like scan_file, for anything but a regular file under max bytes.
+    on_result, if given, is called with each per-file result (or skip record) as soon as it is ready.
+    With blob_shas ({path: blob SHA}) and a BlobCache, files whose blob was scanned
+    before are served from the cache and only new blobs are read.
+    """
+    report = SecurityReport()
+
+    def accept(result, size=0):
+        report.add(result, size)
+        # Binaries and empty files have no result to pass on.
+        if on_result and result is not None:
+            on_result(result)
+
+    candidates = []
+    for relpath, size in (files if files is not None else iter_scan_files(root)):
+        if size > MAX_FILE_BYTES:
+            accept({'path': relpath, 'skipped': TOO_LARGE})
+        else:
+            candidates.append((relpath, size))
+
+    # Manifest parsing depends on the file name, so it is part of the cache key.
+    cache_keys = {}
+    if cache is not None and blob_shas:
+        for relpath, _ in candidates:
+            if relpath in blob_shas:
+                filename = os.path.basename(relpath)
+                cache_keys[relpath] = (blob_shas[relpath], f":{filename}" if parser_for(filename) else '')
+    cached = cache.get_many('security', ANALYZER_VERSION, set(cache_keys.values())) if cache_keys else {}
+
+    from_cache = 0
+    fresh = {}
+    for relpath, size in candidates:
+        key = cache_keys.get(relpath)
+        if key in cached:
+            from_cache += 1
+            # None marks a blob that was binary or empty last time.
+            result = cached[key] and {**cached[key], 'path': relpath}
+            accept(result, size)
+            continue
+        try:
+            if data_for:
+                with data_for(relpath, MAX_FILE_BYTES) as data:
+                    result = scan_data(relpath, data)
+            else:
+                result = scan_file(root, relpath)
+        except SkippedFile as e:
+            accept({'path': relpath, 'skipped': str(e)})
+            continue
+        except OSError as e:
+            accept({'path': relpath, 'skipped': f"error: {e}"})
+            continue
+        accept(result, size)
+        if key:
+            fresh[key] = result and {k: v for k, v in result.items() if k != 'path'}
+    if fresh:
+        cache.put_many('security', ANALYZER_VERSION, fresh)
+
+    security_report = report.to_dict(index)
+    security_report['filesFromCache'] = from_cache
+    return security_report
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The worker's modules are flat scripts; make them and the shared modules importable.
+_WORKER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _path in (_WORKER_DIR, os.path.join(os.path.dirname(_WORKER_DIR), 'dispatch-worker-common')):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
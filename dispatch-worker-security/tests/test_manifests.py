@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from manifests import (parse_cargo_lock, parse_go_sum, parse_package_json, parse_package_lock,
+                       parse_pipfile_lock, parse_poetry_lock, parse_requirements, parse_yarn_lock, parser_for)
+from scanner import scan_data
+
+
+def test_requirements_keeps_only_pinned_versions():
+    text = "requests==2.31.0\nflask>=2.0\nDjango[argon2] === 4.2.1 ; python_version > '3.8'\n# pytest==7.0\n"
+    assert parse_requirements(text) == [('PyPI', 'requests', '2.31.0'), ('PyPI', 'Django', '4.2.1')]
+
+
+def test_pipfile_lock():
+    text = json.dumps({
+        'default': {'requests': {'version': '==2.31.0'}, 'local': {'path': '.'}},
+        'develop': {'pytest': {'version': '==7.4.0'}},
+    })
+    assert parse_pipfile_lock(text) == [('PyPI', 'requests', '2.31.0'), ('PyPI', 'pytest', '7.4.0')]
+
+
+def test_poetry_and_cargo_lock():
+    text = '[[package]]\nname = "serde"\nversion = "1.0.188"\n\n[[package]]\nname = "rand"\nversion = "0.8.5"\n'
+    assert parse_poetry_lock(text) == [('PyPI', 'serde', '1.0.188'), ('PyPI', 'rand', '0.8.5')]
+    assert parse_cargo_lock(text) == [('crates.io', 'serde', '1.0.188'), ('crates.io', 'rand', '0.8.5')]
+
+
+def test_package_lock_v3():
+    text = json.dumps({'lockfileVersion': 3, 'packages': {
+        '': {'name': 'app', 'version': '1.0.0'},
+        'node_modules/lodash': {'version': '4.17.21'},
+        'node_modules/a/node_modules/@scope/b': {'version': '2.0.0'},
+        'node_modules/linked': {'version': '1.0.0', 'link': True},
+    }})
+    assert parse_package_lock(text) == [('npm', 'lodash', '4.17.21'), ('npm', '@scope/b', '2.0.0')]
+
+
+def test_package_lock_v1():
+    text = json.dumps({'lockfileVersion': 1, 'dependencies': {
+        'express': {'version': '4.18.2', 'dependencies': {'debug': {'version': '2.6.9'}}},
+    }})
+    assert sorted(parse_package_lock(text)) == [('npm', 'debug', '2.6.9'), ('npm', 'express', '4.18.2')]
+
+
+def test_yarn_lock():
+    text = ('"@babel/core@^7.0.0":\n  version "7.22.5"\n  resolved "https://x"\n\n'
+            'lodash@^4.17.0, lodash@^4.17.21:\n  version "4.17.21"\n')
+    assert parse_yarn_lock(text) == [('npm', '@babel/core', '7.22.5'), ('npm', 'lodash', '4.17.21')]
+
+
+def test_package_json_keeps_only_exact_versions():
+    text = json.dumps({'dependencies': {'react': '18.2.0', 'vue': '^3.0.0'}, 'devDependencies': {'jest': '29.7.0'}})
+    assert parse_package_json(text) == [('npm', 'react', '18.2.0'), ('npm', 'jest', '29.7.0')]
+
+
+def test_go_sum():
+    text = ('golang.org/x/text v0.3.7 h1:abc=\n'
+            'golang.org/x/text v0.3.7/go.mod h1:def=\n')
+    assert parse_go_sum(text) == [('Go', 'golang.org/x/text', 'v0.3.7')]
+
+
+def test_parser_for():
+    assert parser_for('package-lock.json') is parse_package_lock
+    assert parser_for('requirements-dev.txt') is parse_requirements
+    assert parser_for('README.md') is None
+
+
+@pytest.mark.parametrize('parser, text', [
+    (parse_package_json, '[]'),
+    (parse_package_json, '"x"'),
+    (parse_package_json, '{"dependencies": ["a"]}'),
+    (parse_package_json, '{"dependencies": null, "devDependencies": 3}'),
+    (parse_package_lock, '"x"'),
+    (parse_package_lock, '[1, 2]'),
+    (parse_package_lock, '{"packages": ["a"]}'),
+    (parse_package_lock, '{"packages": {"node_modules/a": "1.0.0"}}'),
+    (parse_package_lock, '{"packages": {"node_modules/a": {"version": 1}}}'),
+    (parse_package_lock, '{"dependencies": {"a": ["1.0.0"], "b": {"dependencies": "c"}}}'),
+    (parse_pipfile_lock, '{"default": {"a": "1.0"}}'),
+    (parse_pipfile_lock, '{"default": {"a": {"version": ["==1.0"]}}, "develop": []}'),
+    (parse_pipfile_lock, 'null'),
+])
+def test_wrongly_typed_json_yields_no_dependencies(parser, text):
+    assert parser(text) == []
+
+
+@pytest.mark.parametrize('parser', [parse_package_json, parse_package_lock, parse_pipfile_lock])
+def test_unparseable_json_raises_value_error(parser):
+    with pytest.raises(ValueError):
+        parser('{not json')
+    with pytest.raises(ValueError):
+        parser('[' * 100000)
+
+
+@pytest.mark.parametrize('filename, text', [
+    ('package.json', '[]'),
+    ('package-lock.json', '"x"'),
+    ('Pipfile.lock', '{"default": {"a": "1.0"}}'),
+    ('package.json', '{"dependencies": '),
+])
+def test_scan_data_survives_malformed_manifests(filename, text):
+    result = scan_data(f"fixtures/{filename}", text.encode())
+    assert result['dependencies'] == []